@@ -1,19 +1,19 @@
 """
 Inventory API Routes - Products and Categories
 """
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from datetime import date
 from decimal import Decimal
 
 from app.core.database import get_db
 from app.core.security import get_current_active_user, PermissionChecker
 from app.schemas import (
-    ProductCreate, ProductUpdate, ProductResponse, StockAdjustmentCreate,
+    ProductCreate, ProductUpdate, ProductResponse, StockAdjustmentCreate, StockAdjustmentBulkItem,
     CategoryCreate, CategoryUpdate, CategoryResponse
 )
-from app.services.inventory_service import ProductService, CategoryService
+from app.services.inventory_service import ProductService, CategoryService, invalidate_product_cache
 
 router = APIRouter(prefix="/inventory", tags=["Inventory"])
 
@@ -110,37 +110,26 @@ async def delete_category(
 
 @router.get("/products")
 async def list_products(
+    response: Response,
     include_inactive: bool = False,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    after_id: Optional[int] = None,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_active_user)
 ):
-    """List all products for current branch"""
-    product_service = ProductService(db)
-    products = product_service.get_by_branch(current_user.selected_branch.id, include_inactive)
+    """
+    List products for current branch.
     
-    # Convert to dict with category info
-    result = []
-    for p in products:
-        p_dict = {
-            'id': p.id,
-            'name': p.name,
-            'sku': p.sku,
-            'description': p.description,
-            'unit': p.unit,
-            'purchase_price': float(p.purchase_price),
-            'sales_price': float(p.sales_price),
-            'opening_stock': float(p.opening_stock),
-            'stock_quantity': float(p.stock_quantity),
-            'reorder_level': float(p.reorder_level),
-            'is_active': p.is_active,
-            'category_id': p.category_id,
-            'branch_id': p.branch_id,
-            'business_id': p.business_id,
-            'created_at': p.created_at.isoformat() if p.created_at else None,
-            'category': {'id': p.category.id, 'name': p.category.name} if p.category else None
-        }
-        result.append(p_dict)
-    return result
+    Without a limit all products are returned. With a limit, the id to pass
+    as after_id for the next page is sent in the X-Next-Cursor header.
+    """
+    product_service = ProductService(db)
+    products = product_service.get_by_branch(
+        current_user.selected_branch.id, include_inactive, limit=limit, after_id=after_id
+    )
+    if limit and len(products) == limit:
+        response.headers["X-Next-Cursor"] = str(products[-1]['id'])
+    return products
 
 
 @router.get("/products/low-stock")
@@ -184,15 +173,38 @@ async def create_product(
 ):
     """Create a new product"""
     product_service = ProductService(db)
-    product = product_service.create(
-        product_data,
-        current_user.selected_branch.id,
-        current_user.business_id
-    )
+    try:
+        product = product_service.create(
+            product_data,
+            current_user.selected_branch.id,
+            current_user.business_id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     db.commit()
     return product
 
 
+@router.post("/products/bulk", response_model=List[ProductResponse], dependencies=[Depends(PermissionChecker(["inventory:create"]))])
+async def bulk_create_products(
+    products_data: List[ProductCreate],
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_active_user)
+):
+    """Create many products in one batch (e.g. catalog import)"""
+    product_service = ProductService(db)
+    try:
+        products = product_service.bulk_create(
+            products_data,
+            current_user.selected_branch.id,
+            current_user.business_id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    db.commit()
+    return products
+
+
 @router.get("/products/{product_id}")
 async def get_product(
     product_id: int,
@@ -238,6 +250,7 @@ async def toggle_product_status(
         raise HTTPException(status_code=404, detail="Product not found")
     
     product.is_active = not product.is_active
+    invalidate_product_cache(db, current_user.selected_branch.id)
     db.commit()
     return {"message": f"Product {'activated' if product.is_active else 'deactivated'}", "is_active": product.is_active}
 
@@ -251,7 +264,12 @@ async def update_product(
 ):
     """Update product"""
     product_service = ProductService(db)
-    product = product_service.update(product_id, current_user.selected_branch.id, product_data)
+    try:
+        product = product_service.update(
+            product_id, current_user.selected_branch.id, product_data, current_user.business_id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     db.commit()
@@ -291,6 +309,26 @@ async def adjust_product_stock(
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@router.post("/stock-adjustments/bulk", dependencies=[Depends(PermissionChecker(["inventory:adjust_stock"]))])
+async def bulk_adjust_stock(
+    adjustments: List[StockAdjustmentBulkItem],
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_active_user)
+):
+    """Adjust stock for many products in one batch"""
+    product_service = ProductService(db)
+    try:
+        new_stock = product_service.bulk_adjust_stock(
+            [(a.product_id, a.quantity_change, a.reason) for a in adjustments],
+            current_user.id,
+            current_user.selected_branch.id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    db.commit()
+    return [{"product_id": pid, "stock_quantity": float(qty)} for pid, qty in new_stock.items()]
+
+
 @router.get("/stock-adjustments")
 async def list_stock_adjustments(
     limit: int = 50,
@@ -19,6 +19,7 @@ async def list_other_incomes(
     category: str = None,
     start_date: date = None,
     end_date: date = None,
+    exact_category: bool = False,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_active_user)
 ):
@@ -29,7 +30,8 @@ async def list_other_incomes(
         current_user.business_id,
         category,
         start_date,
-        end_date
+        end_date,
+        exact_category
     )
     
     # Build response with additional fields
@@ -326,7 +326,7 @@ async def apply_debit_note(
         
         # Get the bill to return updated status
         purchase_service = PurchaseService(db)
-        bill = purchase_service.get_by_id(dn.purchase_bill_id, current_user.business_id)
+        bill = purchase_service.get_by_id_summary(dn.purchase_bill_id, current_user.business_id)
         
         return {
             "message": "Debit note applied successfully",
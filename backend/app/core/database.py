@@ -1,7 +1,7 @@
 """
 Database Configuration
 """
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from typing import Generator
@@ -16,9 +16,25 @@ db_url = settings.database_url
 engine = create_engine(
     db_url,
     connect_args={"check_same_thread": False} if "sqlite" in db_url else {},
-    echo=settings.DEBUG
+    echo=settings.DEBUG,
+    # Room for every statement shape the services emit, so none are recompiled after warm-up
+    query_cache_size=1200,
+    # Rows per INSERT..VALUES batch for the services' executemany inserts (the 2.0 default, pinned)
+    insertmanyvalues_page_size=1000
 )
 
+if "sqlite" in db_url:
+    # pysqlite only opens a transaction before DML, so a SAVEPOINT issued first would
+    # start (and its RELEASE commit) a transaction of its own. Emit BEGIN ourselves so
+    # begin_nested() savepoints always nest inside the session's transaction.
+    @event.listens_for(engine, "connect")
+    def _sqlite_disable_implicit_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _sqlite_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
 # Session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
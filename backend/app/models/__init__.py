@@ -5,7 +5,7 @@ from datetime import datetime, date
 from decimal import Decimal
 from sqlalchemy import (
     Column, Integer, String, Text, Boolean, DateTime, Date, Numeric,
-    ForeignKey, Enum, Table, Index, UniqueConstraint, CheckConstraint
+    ForeignKey, Enum, Table, Index, UniqueConstraint, CheckConstraint, text
 )
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.ext.declarative import declarative_base
@@ -290,7 +290,7 @@ class Account(Base):
         return type_map.get(self.type.lower(), None)
     
     __table_args__ = (
-        Index('ix_accounts_business_id', 'business_id'),
+        Index('ix_accounts_business_name', 'business_id', 'name'),
         Index('ix_accounts_code', 'code'),
     )
 
@@ -365,7 +365,8 @@ class LedgerEntry(Base):
     branch = relationship("Branch")
 
     __table_args__ = (
-        Index('ix_ledger_entries_account_id', 'account_id'),
+        # Covers the per-account/branch SUM(debit - credit) balance lookups without touching the table
+        Index('ix_ledger_entries_account_branch_amounts', 'account_id', 'branch_id', 'debit', 'credit'),
         Index('ix_ledger_entries_transaction_date', 'transaction_date'),
         Index('ix_ledger_entries_bank_account_id', 'bank_account_id'),
     )
@@ -463,11 +464,11 @@ class Product(Base):
     sku = Column(String(100), nullable=True)
     description = Column(Text, nullable=True)
     unit = Column(String(20), default="pcs")
-    purchase_price = Column(Numeric(15, 2), default=Decimal("0.00"))
-    sales_price = Column(Numeric(15, 2), default=Decimal("0.00"))
-    opening_stock = Column(Numeric(15, 2), default=Decimal("0.00"))
-    stock_quantity = Column(Numeric(15, 2), default=Decimal("0.00"))
-    reorder_level = Column(Numeric(15, 2), default=Decimal("0.00"))
+    purchase_price = Column(Numeric(15, 2), default=Decimal("0.00"), server_default=text("0"))
+    sales_price = Column(Numeric(15, 2), default=Decimal("0.00"), server_default=text("0"))
+    opening_stock = Column(Numeric(15, 2), default=Decimal("0.00"), server_default=text("0"))
+    stock_quantity = Column(Numeric(15, 2), default=Decimal("0.00"), server_default=text("0"))
+    reorder_level = Column(Numeric(15, 2), default=Decimal("0.00"), server_default=text("0"))
     is_active = Column(Boolean, default=True)
     category_id = Column(Integer, ForeignKey('categories.id', ondelete='SET NULL'), nullable=True)
     branch_id = Column(Integer, ForeignKey('branches.id', ondelete='CASCADE'), nullable=False)
@@ -484,8 +485,20 @@ class Product(Base):
     purchase_bill_items = relationship("PurchaseBillItem", back_populates="product")
     
     __table_args__ = (
+        # Also serves SKU lookups (sku is its leading column)
+        UniqueConstraint('sku', 'business_id', name='uq_product_sku'),
+        # Non-negative amounts are validated by the schemas; these are the safety net
+        CheckConstraint('purchase_price >= 0', name='ck_product_purchase_price_nonneg'),
+        CheckConstraint('sales_price >= 0', name='ck_product_sales_price_nonneg'),
+        CheckConstraint('opening_stock >= 0', name='ck_product_opening_stock_nonneg'),
+        CheckConstraint('reorder_level >= 0', name='ck_product_reorder_level_nonneg'),
         Index('ix_products_business_id', 'business_id'),
-        Index('ix_products_sku', 'sku'),
+        # Partial index for the low-stock dashboard query
+        Index(
+            'ix_products_low_stock', 'branch_id',
+            postgresql_where=text('is_active AND stock_quantity <= reorder_level'),
+            sqlite_where=text('is_active = 1 AND stock_quantity <= reorder_level'),
+        ),
     )
 
 
@@ -541,7 +554,8 @@ class SalesInvoice(Base):
     
     __table_args__ = (
         UniqueConstraint('invoice_number', 'business_id', name='uq_sales_invoice_number'),
-        Index('ix_sales_invoices_business_id', 'business_id'),
+        # Business filters and dated history lookups (valuation as-of, movements)
+        Index('ix_sales_invoices_business_date', 'business_id', 'invoice_date'),
     )
 
 
@@ -561,6 +575,10 @@ class SalesInvoiceItem(Base):
     product = relationship("Product", back_populates="sales_invoice_items")
     sales_invoice = relationship("SalesInvoice", back_populates="items")
     
+    __table_args__ = (
+        Index('ix_sales_invoice_items_product_invoice', 'product_id', 'sales_invoice_id'),
+    )
+    
     @property
     def total(self):
         return self.quantity * self.price
@@ -676,7 +694,10 @@ class PurchaseBill(Base):
     
     __table_args__ = (
         UniqueConstraint('bill_number', 'business_id', name='uq_purchase_bill_number'),
-        Index('ix_purchase_bills_business_id', 'business_id'),
+        # Business filters and dated history lookups (valuation as-of, movements)
+        Index('ix_purchase_bills_business_date', 'business_id', 'bill_date'),
+        # Branch bill lists, newest first
+        Index('ix_purchase_bills_branch_created', 'business_id', 'branch_id', 'created_at'),
     )
 
 
@@ -696,6 +717,10 @@ class PurchaseBillItem(Base):
     product = relationship("Product", back_populates="purchase_bill_items")
     purchase_bill = relationship("PurchaseBill", back_populates="items")
     
+    __table_args__ = (
+        Index('ix_purchase_bill_items_product_bill', 'product_id', 'purchase_bill_id'),
+    )
+    
     @property
     def total(self):
         return self.quantity * self.price
@@ -731,6 +756,8 @@ class DebitNote(Base):
     
     __table_args__ = (
         UniqueConstraint('debit_note_number', 'business_id', name='uq_debit_note_number'),
+        # Branch debit note lists, newest first
+        Index('ix_debit_notes_branch_created', 'business_id', 'branch_id', 'created_at'),
     )
 
 
@@ -821,6 +848,8 @@ class OtherIncome(Base):
     
     __table_args__ = (
         UniqueConstraint('income_number', 'business_id', name='uq_income_number'),
+        Index('ix_other_incomes_branch_date', 'business_id', 'branch_id', 'income_date', 'id'),
+        Index('ix_other_incomes_business_category', 'business_id', 'category'),
     )
 
 
@@ -1298,6 +1327,7 @@ class CashBookEntry(Base):
         Index('ix_cash_book_entries_date', 'entry_date'),
         Index('ix_cash_book_entries_account', 'account_id'),
         Index('ix_cash_book_entries_type', 'entry_type'),
+        Index('ix_cash_book_entries_business_number', 'business_id', 'entry_number'),
     )
 
 
@@ -368,6 +368,10 @@ class StockAdjustmentCreate(BaseModel):
     reason: str = Field(..., min_length=2, max_length=500)
 
 
+class StockAdjustmentBulkItem(StockAdjustmentCreate):
+    product_id: int
+
+
 class StockAdjustmentResponse(BaseModel):
     id: int
     product_id: int
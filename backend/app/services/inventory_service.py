@@ -1,26 +1,127 @@
 """
 Inventory Service - Products, Categories, Stock Management
 """
-from typing import Optional, List
-from sqlalchemy.orm import Session, joinedload
+import threading
+from typing import Optional, List, Dict, Tuple, Iterator
+from cachetools import TTLCache
+from sqlalchemy import event, select, insert, update, delete, exists, desc, case, bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased, joinedload, selectinload, raiseload
 from decimal import Decimal
 from datetime import date
-from app.models import Product, Category, StockAdjustment
+from app.models import Product, Category, StockAdjustment, SalesInvoiceItem, PurchaseBillItem, User
 from app.schemas import ProductCreate, ProductUpdate, CategoryCreate, CategoryUpdate, StockAdjustmentCreate
 
 
+# Short-lived, process-local cache for the product list that dashboards poll.
+# Entries are tuples of plain row dicts keyed by (branch_id, include_inactive, limit, after_id).
+PRODUCT_LIST_CACHE_TTL = 15
+_product_list_cache = TTLCache(maxsize=1024, ttl=PRODUCT_LIST_CACHE_TTL)
+_product_list_cache_lock = threading.Lock()
+# Name of the (sku, business_id) unique constraint on products
+_SKU_CONSTRAINT = 'uq_product_sku'
+# Session.info key holding the branch ids to drop from the cache once the session commits
+_STALE_BRANCHES_KEY = 'stale_product_list_branches'
+
+
+# Built once at import; per-call values are bound at execution time
+_ADJUSTMENTS_STMT = (
+    select(
+        StockAdjustment.id,
+        StockAdjustment.product_id,
+        Product.name.label('product_name'),
+        Product.sku.label('product_sku'),
+        StockAdjustment.quantity_change,
+        StockAdjustment.reason,
+        User.full_name,
+        User.username,
+        StockAdjustment.created_at
+    )
+    .join(Product, StockAdjustment.product_id == Product.id)
+    .outerjoin(User, StockAdjustment.user_id == User.id)
+    .where(Product.branch_id == bindparam('branch_id'))
+    .order_by(desc(StockAdjustment.created_at))
+    .limit(bindparam('limit'))
+)
+
+
+def invalidate_product_cache(db: Session, branch_id: int) -> None:
+    """Drop cached product lists for a branch once db commits its product changes"""
+    db.info.setdefault(_STALE_BRANCHES_KEY, set()).add(branch_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _drop_stale_product_lists(session: Session) -> None:
+    branch_ids = session.info.pop(_STALE_BRANCHES_KEY, None)
+    if not branch_ids:
+        return
+    with _product_list_cache_lock:
+        for key in [k for k in _product_list_cache if k[0] in branch_ids]:
+            _product_list_cache.pop(key, None)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_stale_product_lists(session: Session) -> None:
+    session.info.pop(_STALE_BRANCHES_KEY, None)
+
+
+def _is_sku_clash(error: IntegrityError) -> bool:
+    """True when error is a violation of uq_product_sku"""
+    diag = getattr(error.orig, 'diag', None)
+    if diag is not None:
+        return diag.constraint_name == _SKU_CONSTRAINT
+    # SQLite reports the constrained columns instead of the constraint name
+    message = str(error.orig)
+    return _SKU_CONSTRAINT in message or 'products.sku, products.business_id' in message
+
+
+def _product_row(product: Product) -> dict:
+    return {
+        'id': product.id,
+        'name': product.name,
+        'sku': product.sku,
+        'description': product.description,
+        'unit': product.unit,
+        'purchase_price': float(product.purchase_price),
+        'sales_price': float(product.sales_price),
+        'opening_stock': float(product.opening_stock),
+        'stock_quantity': float(product.stock_quantity),
+        'reorder_level': float(product.reorder_level),
+        'is_active': product.is_active,
+        'category_id': product.category_id,
+        'branch_id': product.branch_id,
+        'business_id': product.business_id,
+        'created_at': product.created_at.isoformat() if product.created_at else None,
+        'category': {'id': product.category.id, 'name': product.category.name} if product.category else None
+    }
+
+
 class CategoryService:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, cache: bool = False):
+        """
+        Pass cache=True for bulk flows (imports, batch updates) that look up
+        the same categories repeatedly and have no concurrent writers.
+        """
         self.db = db
+        self.cache = cache
+        self._cache: Dict[Tuple[int, int], Optional[Category]] = {}
     
     def get_by_id(self, category_id: int, branch_id: int) -> Optional[Category]:
-        return self.db.query(Category).filter(
-            Category.id == category_id,
-            Category.branch_id == branch_id
-        ).first()
+        key = (category_id, branch_id)
+        if self.cache and key in self._cache:
+            return self._cache[key]
+        # Session.get answers from the identity map when the row is already loaded
+        category = self.db.get(Category, category_id, options=[raiseload("*")])
+        if category is not None and category.branch_id != branch_id:
+            category = None
+        if self.cache:
+            self._cache[key] = category
+        return category
     
     def get_by_branch(self, branch_id: int) -> List[Category]:
-        return self.db.query(Category).filter(Category.branch_id == branch_id).all()
+        return self.db.query(Category).options(
+            selectinload(Category.products), raiseload("*")
+        ).filter(Category.branch_id == branch_id).all()
     
     def create(self, category_data: CategoryCreate, branch_id: int, business_id: int) -> Category:
         category = Category(
@@ -34,29 +135,32 @@ class CategoryService:
         return category
     
     def update(self, category_id: int, branch_id: int, category_data: CategoryUpdate) -> Optional[Category]:
-        category = self.get_by_id(category_id, branch_id)
-        if not category:
-            return None
-        
         update_data = category_data.model_dump(exclude_unset=True)
-        for key, value in update_data.items():
-            setattr(category, key, value)
+        if not update_data:
+            return self.get_by_id(category_id, branch_id)
         
-        self.db.flush()
+        category = self.db.execute(
+            update(Category)
+            .where(Category.id == category_id, Category.branch_id == branch_id)
+            .values(**update_data)
+            .returning(Category)
+        ).scalar_one_or_none()
+        self._cache.pop((category_id, branch_id), None)
         return category
     
     def delete(self, category_id: int, branch_id: int) -> bool:
-        category = self.get_by_id(category_id, branch_id)
-        if not category:
-            return False
-        
-        # Check for products
-        has_products = self.db.query(Product).filter(Product.category_id == category_id).first()
-        if has_products:
-            return False
-        
-        self.db.delete(category)
-        return True
+        # Categories that still have products are left in place
+        deleted_id = self.db.execute(
+            delete(Category)
+            .where(
+                Category.id == category_id,
+                Category.branch_id == branch_id,
+                ~exists().where(Product.category_id == category_id)
+            )
+            .returning(Category.id)
+        ).scalar_one_or_none()
+        self._cache.pop((category_id, branch_id), None)
+        return deleted_id is not None
 
 
 class ProductService:
@@ -64,15 +168,18 @@ class ProductService:
         self.db = db
     
     def get_by_id(self, product_id: int, branch_id: int = None, business_id: int = None) -> Optional[Product]:
-        query = self.db.query(Product).options(joinedload(Product.category))
-        if branch_id:
-            query = query.filter(Product.branch_id == branch_id)
-        if business_id:
-            query = query.filter(Product.business_id == business_id)
-        return query.filter(Product.id == product_id).first()
+        # Session.get answers from the identity map when the row is already loaded
+        product = self.db.get(Product, product_id, options=[joinedload(Product.category), raiseload("*")])
+        if product is None:
+            return None
+        if branch_id and product.branch_id != branch_id:
+            return None
+        if business_id and product.business_id != business_id:
+            return None
+        return product
     
     def get_by_sku(self, sku: str, branch_id: int, business_id: int = None) -> Optional[Product]:
-        query = self.db.query(Product).filter(
+        query = self.db.query(Product).options(raiseload("*")).filter(
             Product.sku == sku,
             Product.branch_id == branch_id
         )
@@ -84,91 +191,182 @@ class ProductService:
         """Check if SKU is unique within the business"""
         if not sku:
             return True  # Empty SKU is allowed
-        query = self.db.query(Product).filter(
+        query = self.db.query(Product.id).filter(
             Product.sku == sku,
             Product.business_id == business_id
         )
         if exclude_product_id:
             query = query.filter(Product.id != exclude_product_id)
-        return query.first() is None
+        return not self.db.query(query.exists()).scalar()
     
-    def get_by_branch(self, branch_id: int, include_inactive: bool = False) -> List[Product]:
-        query = self.db.query(Product).options(joinedload(Product.category)).filter(
+    def get_by_branch(
+        self,
+        branch_id: int,
+        include_inactive: bool = False,
+        limit: Optional[int] = None,
+        after_id: Optional[int] = None
+    ) -> List[dict]:
+        """
+        Get products for a branch ordered by id, as plain row dicts.
+        
+        Pass limit/after_id for keyset pagination: after_id is the id of the
+        last product on the previous page.
+        """
+        key = (branch_id, include_inactive, limit, after_id)
+        with _product_list_cache_lock:
+            cached = _product_list_cache.get(key)
+        if cached is not None:
+            return [dict(row) for row in cached]
+        
+        query = self.db.query(Product).options(joinedload(Product.category), raiseload("*")).filter(
             Product.branch_id == branch_id
         )
         if not include_inactive:
             query = query.filter(Product.is_active == True)
-        return query.all()
+        if after_id:
+            query = query.filter(Product.id > after_id)
+        query = query.order_by(Product.id)
+        if limit:
+            query = query.limit(limit)
+        rows = tuple(_product_row(product) for product in query.all())
+        with _product_list_cache_lock:
+            _product_list_cache[key] = rows
+        return [dict(row) for row in rows]
+    
+    def stream_by_branch(self, branch_id: int, include_inactive: bool = False) -> Iterator[Product]:
+        """
+        Iterate over every product of a branch, hydrating 500 rows at a time.
+        
+        Meant for full-catalog exports. The session and its transaction must
+        stay open until iteration finishes.
+        """
+        stmt = select(Product).options(selectinload(Product.category), raiseload("*")).where(
+            Product.branch_id == branch_id
+        )
+        if not include_inactive:
+            stmt = stmt.where(Product.is_active == True)
+        yield from self.db.scalars(stmt.order_by(Product.id).execution_options(yield_per=500))
     
     def get_low_stock(self, branch_id: int) -> List[Product]:
         """Get products below reorder level"""
-        return self.db.query(Product).filter(
+        query = self.db.query(Product).options(joinedload(Product.category), raiseload("*")).filter(
             Product.branch_id == branch_id,
             Product.is_active == True,
             Product.stock_quantity <= Product.reorder_level
-        ).all()
+        )
+        return query.all()
     
     def create(self, product_data: ProductCreate, branch_id: int, business_id: int) -> Product:
-        # Validate SKU uniqueness if provided
-        if product_data.sku and not self.is_sku_unique(product_data.sku, business_id):
-            raise ValueError(f"Product with SKU '{product_data.sku}' already exists in this business")
-        
-        # Validate prices are not negative
-        if product_data.purchase_price is not None and product_data.purchase_price < 0:
-            raise ValueError("Purchase price cannot be negative")
-        if product_data.sales_price is not None and product_data.sales_price < 0:
-            raise ValueError("Sales price cannot be negative")
-        
-        # Validate stock quantities
-        if product_data.opening_stock is not None and product_data.opening_stock < 0:
-            raise ValueError("Opening stock cannot be negative")
-        if product_data.reorder_level is not None and product_data.reorder_level < 0:
-            raise ValueError("Reorder level cannot be negative")
-        
         product = Product(
             name=product_data.name,
-            sku=product_data.sku,
+            sku=product_data.sku or None,
             description=product_data.description,
             unit=product_data.unit,
-            purchase_price=product_data.purchase_price or Decimal("0"),
-            sales_price=product_data.sales_price or Decimal("0"),
-            opening_stock=product_data.opening_stock or Decimal("0"),
-            stock_quantity=product_data.opening_stock or Decimal("0"),
-            reorder_level=product_data.reorder_level or Decimal("0"),
+            purchase_price=product_data.purchase_price,
+            sales_price=product_data.sales_price,
+            opening_stock=product_data.opening_stock,
+            stock_quantity=product_data.opening_stock,
+            reorder_level=product_data.reorder_level,
             category_id=product_data.category_id,
             branch_id=branch_id,
             business_id=business_id
         )
-        self.db.add(product)
-        self.db.flush()
+        # SKU uniqueness is enforced by uq_product_sku; let the INSERT detect clashes.
+        # The savepoint confines a failed INSERT to this product.
+        try:
+            with self.db.begin_nested():
+                self.db.add(product)
+                self.db.flush()
+        except IntegrityError as e:
+            if product_data.sku and _is_sku_clash(e):
+                raise ValueError(f"Product with SKU '{product_data.sku}' already exists in this business")
+            raise
+        invalidate_product_cache(self.db, branch_id)
         return product
     
-    def update(self, product_id: int, branch_id: int, product_data: ProductUpdate, business_id: int = None) -> Optional[Product]:
-        product = self.get_by_id(product_id, branch_id, business_id)
-        if not product:
-            return None
+    def bulk_create(self, products_data: List[ProductCreate], branch_id: int, business_id: int) -> List[Product]:
+        """
+        Create many products with a single batched INSERT.
         
-        update_data = product_data.model_dump(exclude_unset=True)
+        SKUs are validated up-front with one query for the whole batch.
+        """
+        if not products_data:
+            return []
         
-        # Validate SKU uniqueness if being updated
-        if 'sku' in update_data and update_data['sku'] and business_id:
-            if not self.is_sku_unique(update_data['sku'], business_id, exclude_product_id=product_id):
-                raise ValueError(f"Product with SKU '{update_data['sku']}' already exists in this business")
+        skus = [p.sku for p in products_data if p.sku]
+        duplicates = {sku for sku in skus if skus.count(sku) > 1}
+        if duplicates:
+            raise ValueError(f"Duplicate SKUs in import: {', '.join(sorted(duplicates))}")
+        if skus:
+            existing = self.db.query(Product.sku).filter(
+                Product.business_id == business_id,
+                Product.sku.in_(skus)
+            ).all()
+            if existing:
+                raise ValueError(
+                    f"Products with SKUs {', '.join(sorted(r.sku for r in existing))} already exist in this business"
+                )
         
-        # Validate prices are not negative
-        if 'purchase_price' in update_data and update_data['purchase_price'] is not None and update_data['purchase_price'] < 0:
-            raise ValueError("Purchase price cannot be negative")
-        if 'sales_price' in update_data and update_data['sales_price'] is not None and update_data['sales_price'] < 0:
-            raise ValueError("Sales price cannot be negative")
+        # Leave unset fields out so the column defaults apply, as with ORM inserts
+        rows = [
+            {key: value for key, value in {
+                'name': p.name,
+                'sku': p.sku or None,
+                'description': p.description,
+                'unit': p.unit,
+                'purchase_price': p.purchase_price,
+                'sales_price': p.sales_price,
+                'opening_stock': p.opening_stock,
+                'stock_quantity': p.opening_stock,
+                'reorder_level': p.reorder_level,
+                'category_id': p.category_id,
+                'branch_id': branch_id,
+                'business_id': business_id,
+            }.items() if value is not None}
+            for p in products_data
+        ]
+        products = list(self.db.scalars(insert(Product).returning(Product), rows))
+        invalidate_product_cache(self.db, branch_id)
+        return products
+    
+    def update(self, product_id: int, branch_id: int, product_data: ProductUpdate, business_id: int = None) -> Optional[Product]:
+        update_data = product_data.model_dump(exclude_unset=True)
+        if not update_data:
+            return self.get_by_id(product_id, branch_id, business_id)
+        if 'sku' in update_data:
+            update_data['sku'] = update_data['sku'] or None
         
-        # Validate stock quantities
-        if 'reorder_level' in update_data and update_data['reorder_level'] is not None and update_data['reorder_level'] < 0:
-            raise ValueError("Reorder level cannot be negative")
+        stmt = update(Product).where(Product.id == product_id, Product.branch_id == branch_id)
+        if business_id:
+            stmt = stmt.where(Product.business_id == business_id)
+        sku_conflict = None
+        if update_data.get('sku'):
+            # SKU must stay unique within the product's business; checked in the same statement
+            other = aliased(Product)
+            sku_conflict = exists().where(
+                other.business_id == Product.business_id,
+                other.sku == update_data['sku'],
+                other.id != Product.id
+            )
+            stmt = stmt.where(~sku_conflict)
         
-        for key, value in update_data.items():
-            setattr(product, key, value)
+        try:
+            with self.db.begin_nested():
+                product = self.db.execute(stmt.values(**update_data).returning(Product)).scalar_one_or_none()
+        except IntegrityError as e:
+            if update_data.get('sku') and _is_sku_clash(e):
+                raise ValueError(f"Product with SKU '{update_data['sku']}' already exists in this business")
+            raise
         
-        self.db.flush()
+        # No row updated: either the product is missing or its new SKU is taken
+        if product is None and sku_conflict is not None:
+            found = self.db.query(
+                exists().where(Product.id == product_id, Product.branch_id == branch_id)
+            ).scalar()
+            if found:
+                raise ValueError(f"Product with SKU '{update_data['sku']}' already exists in this business")
+        
+        invalidate_product_cache(self.db, branch_id)
         return product
     
     def adjust_stock(self, product_id: int, adjustment_data: StockAdjustmentCreate, user_id: int) -> Optional[Product]:
@@ -192,43 +390,100 @@ class ProductService:
         )
         self.db.add(adjustment)
         self.db.flush()
+        invalidate_product_cache(self.db, product.branch_id)
         
         return product
     
-    def delete(self, product_id: int, branch_id: int) -> bool:
-        product = self.get_by_id(product_id, branch_id)
-        if not product:
-            return False
+    def bulk_adjust_stock(
+        self,
+        adjustments: List[Tuple[int, Decimal, str]],
+        user_id: int,
+        branch_id: int = None
+    ) -> Dict[int, Decimal]:
+        """
+        Apply many (product_id, quantity_change, reason) adjustments at once.
+        
+        Stock is moved with a single UPDATE ... CASE and the adjustment records
+        are written with one batched INSERT. Returns {product_id: new stock}.
+        Raises ValueError if a product is missing or would go negative; the
+        caller must then roll back, as other rows may already be updated.
+        """
+        if not adjustments:
+            return {}
+        
+        deltas: Dict[int, Decimal] = {}
+        for product_id, quantity_change, _ in adjustments:
+            deltas[product_id] = deltas.get(product_id, Decimal("0")) + quantity_change
         
-        # Check for transaction history
-        has_transactions = self.db.query(StockAdjustment).filter(
-            StockAdjustment.product_id == product_id
-        ).first()
+        new_quantity = Product.stock_quantity + case(deltas, value=Product.id)
+        stmt = update(Product).where(Product.id.in_(deltas), new_quantity >= 0)
+        if branch_id:
+            stmt = stmt.where(Product.branch_id == branch_id)
+        rows = self.db.execute(
+            stmt.values(stock_quantity=new_quantity)
+            .returning(Product.id, Product.stock_quantity, Product.branch_id)
+        ).all()
+        
+        rejected = set(deltas) - {r.id for r in rows}
+        if rejected:
+            raise ValueError(
+                f"Products not found or stock cannot be negative: {', '.join(map(str, sorted(rejected)))}"
+            )
+        
+        self.db.execute(insert(StockAdjustment), [
+            {
+                'product_id': product_id,
+                'quantity_change': quantity_change,
+                'reason': reason,
+                'user_id': user_id
+            }
+            for product_id, quantity_change, reason in adjustments
+        ])
         
-        if has_transactions:
-            product.is_active = False
-        else:
-            self.db.delete(product)
+        for changed_branch_id in {r.branch_id for r in rows}:
+            invalidate_product_cache(self.db, changed_branch_id)
+        return {r.id: r.stock_quantity for r in rows}
+    
+    def delete(self, product_id: int, branch_id: int) -> bool:
+        # Products without transaction history are removed outright...
+        deleted_id = self.db.execute(
+            delete(Product)
+            .where(
+                Product.id == product_id,
+                Product.branch_id == branch_id,
+                ~exists().where(StockAdjustment.product_id == product_id),
+                ~exists().where(SalesInvoiceItem.product_id == product_id),
+                ~exists().where(PurchaseBillItem.product_id == product_id)
+            )
+            .returning(Product.id)
+        ).scalar_one_or_none()
+        invalidate_product_cache(self.db, branch_id)
+        if deleted_id is not None:
+            return True
         
-        return True
+        # ...the rest are only deactivated
+        deactivated_id = self.db.execute(
+            update(Product)
+            .where(Product.id == product_id, Product.branch_id == branch_id)
+            .values(is_active=False)
+            .returning(Product.id)
+        ).scalar_one_or_none()
+        return deactivated_id is not None
     
     def get_adjustments(self, branch_id: int, limit: int = 50) -> List[dict]:
         """Get stock adjustments for a branch"""
-        from sqlalchemy import desc
-        adjustments = self.db.query(StockAdjustment).join(Product).filter(
-            Product.branch_id == branch_id
-        ).order_by(desc(StockAdjustment.created_at)).limit(limit).all()
-        
-        result = []
-        for adj in adjustments:
-            result.append({
-                'id': adj.id,
-                'product_id': adj.product_id,
-                'product_name': adj.product.name if adj.product else 'Unknown',
-                'product_sku': adj.product.sku if adj.product else None,
-                'quantity_change': float(adj.quantity_change),
-                'reason': adj.reason,
-                'user_name': adj.user.full_name or adj.user.username if adj.user else 'System',
-                'created_at': adj.created_at.strftime('%Y-%m-%d %H:%M') if adj.created_at else None
-            })
-        return result
+        rows = self.db.execute(_ADJUSTMENTS_STMT, {'branch_id': branch_id, 'limit': limit})
+        
+        return [
+            {
+                'id': r.id,
+                'product_id': r.product_id,
+                'product_name': r.product_name,
+                'product_sku': r.product_sku,
+                'quantity_change': float(r.quantity_change),
+                'reason': r.reason,
+                'user_name': r.full_name or r.username or 'System',
+                'created_at': r.created_at.strftime('%Y-%m-%d %H:%M') if r.created_at else None
+            }
+            for r in rows
+        ]
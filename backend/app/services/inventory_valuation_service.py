@@ -1,16 +1,22 @@
 """
 Inventory Valuation Service - FIFO and Weighted Average Cost Methods
 """
-from typing import Optional, List, Dict
+from collections import defaultdict
+from typing import Optional, List, Dict, Tuple
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func, and_
+from sqlalchemy import select, union_all, literal, case, type_coerce, Float, func, and_, or_
 from decimal import Decimal
 from datetime import date
-from app.models import Product, PurchaseBillItem, SalesInvoiceItem, LedgerEntry, Account, AccountType
+from app.models import (
+    Product, PurchaseBill, PurchaseBillItem, SalesInvoice, SalesInvoiceItem,
+    LedgerEntry, Account, AccountType
+)
 
 
 class InventoryCostLayer:
     """Represents a cost layer for FIFO inventory tracking"""
+    __slots__ = ('quantity', 'unit_cost', 'date', 'reference')
+    
     def __init__(self, quantity: Decimal, unit_cost: Decimal, date: date, reference: str):
         self.quantity = quantity
         self.unit_cost = unit_cost
@@ -18,11 +24,213 @@ class InventoryCostLayer:
         self.reference = reference
 
 
+def _build_cost_layers(purchase_rows) -> List[InventoryCostLayer]:
+    """Turn date-ordered purchase rows into FIFO cost layers"""
+    return [
+        InventoryCostLayer(
+            quantity=row.net_qty,
+            unit_cost=row.price,  # Use purchase price as unit cost
+            date=row.entry_date,
+            reference=row.reference
+        )
+        for row in purchase_rows
+    ]
+
+
+def _consume_cost_layers(cost_layers: List[InventoryCostLayer], sales_rows) -> List[InventoryCostLayer]:
+    """
+    Consume cost layers oldest-first for every date-ordered sale (FIFO).
+    
+    Returns only the layers that still hold stock.
+    """
+    # Layers are emptied strictly in order, so a cursor on the oldest open
+    # layer replaces rescanning the exhausted ones for every sale.
+    layer_index = 0
+    layer_count = len(cost_layers)
+    
+    for sale in sales_rows:
+        remaining_to_consume = sale.net_qty
+        
+        while remaining_to_consume > 0 and layer_index < layer_count:
+            layer = cost_layers[layer_index]
+            consume_amount = min(layer.quantity, remaining_to_consume)
+            layer.quantity -= consume_amount
+            remaining_to_consume -= consume_amount
+            if layer.quantity <= 0:
+                layer_index += 1
+    
+    return cost_layers[layer_index:]
+
+
+def _cost_from_layers(cost_layers: List[InventoryCostLayer], quantity: Decimal) -> Decimal:
+    """Cost of taking the given quantity from the oldest remaining layers"""
+    cost = Decimal("0")
+    remaining_to_cost = quantity
+    
+    for layer in cost_layers:
+        if remaining_to_cost <= 0:
+            break
+        use_amount = min(layer.quantity, remaining_to_cost)
+        cost += use_amount * layer.unit_cost
+        remaining_to_cost -= use_amount
+    
+    return cost
+
+
+def _fifo_unit_cost(cost_layers: List[InventoryCostLayer]) -> Decimal:
+    """Average unit cost of the layers left after FIFO consumption"""
+    total_value = Decimal("0")
+    total_quantity = Decimal("0")
+    
+    for layer in cost_layers:
+        total_value += layer.quantity * layer.unit_cost
+        total_quantity += layer.quantity
+    
+    if total_quantity > 0:
+        return total_value / total_quantity
+    return Decimal("0")
+
+
+def _history_union(product_ids: List[int], business_id: int,
+                   start_date: date = None, end_date: date = None):
+    """
+    Purchase ('P') and sales ('S') lines of the given products as one UNION ALL.
+    
+    Quantities arrive already net of returns; fully returned lines are left out.
+    """
+    purchase_net_qty = PurchaseBillItem.quantity - func.coalesce(PurchaseBillItem.returned_quantity, 0)
+    sales_net_qty = SalesInvoiceItem.quantity - func.coalesce(SalesInvoiceItem.returned_quantity, 0)
+    
+    purchases = select(
+        PurchaseBillItem.product_id,
+        literal('P').label('kind'),
+        PurchaseBill.bill_date.label('entry_date'),
+        PurchaseBillItem.id.label('item_id'),
+        purchase_net_qty.label('net_qty'),
+        PurchaseBillItem.price,
+        PurchaseBill.bill_number.label('reference')
+    ).join(
+        PurchaseBillItem.purchase_bill
+    ).where(
+        PurchaseBillItem.product_id.in_(product_ids),
+        PurchaseBill.business_id == business_id,
+        purchase_net_qty > 0
+    )
+    
+    sales = select(
+        SalesInvoiceItem.product_id,
+        literal('S').label('kind'),
+        SalesInvoice.invoice_date.label('entry_date'),
+        SalesInvoiceItem.id.label('item_id'),
+        sales_net_qty.label('net_qty'),
+        SalesInvoiceItem.price,
+        SalesInvoice.invoice_number.label('reference')
+    ).join(
+        SalesInvoiceItem.sales_invoice
+    ).where(
+        SalesInvoiceItem.product_id.in_(product_ids),
+        SalesInvoice.business_id == business_id,
+        sales_net_qty > 0
+    )
+    
+    if start_date:
+        purchases = purchases.where(PurchaseBill.bill_date >= start_date)
+        sales = sales.where(SalesInvoice.invoice_date >= start_date)
+    if end_date:
+        purchases = purchases.where(PurchaseBill.bill_date <= end_date)
+        sales = sales.where(SalesInvoice.invoice_date <= end_date)
+    
+    return union_all(purchases, sales)
+
+
+def _history_select(product_ids: List[int], business_id: int,
+                    start_date: date = None, end_date: date = None):
+    """History union ordered by date, with purchases first on the same day"""
+    return _history_union(product_ids, business_id, start_date, end_date).order_by(
+        'entry_date', 'kind', 'item_id'
+    )
+
+
 class InventoryValuationService:
     """Service for calculating inventory values using different methods"""
     
     def __init__(self, db: Session):
         self.db = db
+        # Unit costs already computed by this (request-scoped) instance
+        self._wac_cache: Dict[tuple, Decimal] = {}
+        self._fifo_cache: Dict[tuple, Decimal] = {}
+        self._layer_cache: Dict[tuple, Tuple[InventoryCostLayer, ...]] = {}
+        self._accounts_cache: Dict[int, Dict[str, Account]] = {}
+    
+    def _get_weighted_average_costs(self, product_ids: List[int], business_id: int,
+                                    as_of_date: date) -> Dict[int, Decimal]:
+        """
+        Weighted average unit cost of many products from one GROUP BY query.
+        
+        Products without purchases get a zero cost. Results are memoized
+        alongside calculate_weighted_average_cost.
+        """
+        net_quantity = PurchaseBillItem.quantity - func.coalesce(PurchaseBillItem.returned_quantity, 0)
+        
+        rows = self.db.query(
+            PurchaseBillItem.product_id,
+            func.sum(net_quantity * PurchaseBillItem.price),
+            func.sum(net_quantity)
+        ).join(
+            PurchaseBillItem.purchase_bill
+        ).filter(
+            PurchaseBillItem.product_id.in_(product_ids),
+            PurchaseBill.business_id == business_id,
+            PurchaseBill.bill_date <= as_of_date,
+            net_quantity > 0
+        ).group_by(PurchaseBillItem.product_id).all()
+        
+        costs = {product_id: Decimal("0") for product_id in product_ids}
+        for product_id, total_cost, total_quantity in rows:
+            if total_quantity:
+                costs[product_id] = Decimal(total_cost) / Decimal(total_quantity)
+        
+        for product_id, avg_cost in costs.items():
+            self._wac_cache[(product_id, business_id, as_of_date)] = avg_cost
+        return costs
+    
+    def _get_open_layers(self, product_ids: List[int], business_id: int,
+                         as_of_date: date) -> Dict[int, Tuple[InventoryCostLayer, ...]]:
+        """
+        Open FIFO cost layers per product, replaying history only for products
+        this instance has not replayed yet. Cached layers must not be mutated.
+        """
+        missing = [
+            product_id for product_id in product_ids
+            if (business_id, product_id, as_of_date) not in self._layer_cache
+        ]
+        if missing:
+            purchase_rows, sales_rows = self._get_history_rows(missing, business_id, as_of_date)
+            for product_id in missing:
+                self._layer_cache[(business_id, product_id, as_of_date)] = tuple(_consume_cost_layers(
+                    _build_cost_layers(purchase_rows[product_id]), sales_rows[product_id]
+                ))
+        return {
+            product_id: self._layer_cache[(business_id, product_id, as_of_date)]
+            for product_id in product_ids
+        }
+    
+    def _get_history_rows(self, product_ids: List[int], business_id: int,
+                          as_of_date: date) -> Tuple[Dict[int, list], Dict[int, list]]:
+        """
+        Purchase and sales history for many products in a single UNION ALL
+        round-trip, split into (purchases, sales) grouped by product id.
+        """
+        history = _history_select(product_ids, business_id, end_date=as_of_date)
+        
+        purchase_rows = defaultdict(list)
+        sales_rows = defaultdict(list)
+        for row in self.db.execute(history):
+            if row.kind == 'P':
+                purchase_rows[row.product_id].append(row)
+            else:
+                sales_rows[row.product_id].append(row)
+        return purchase_rows, sales_rows
     
     def calculate_fifo_cost(self, product_id: int, business_id: int, branch_id: int,
                             quantity: Decimal, as_of_date: date = None) -> Decimal:
@@ -35,74 +243,10 @@ class InventoryValuationService:
         if as_of_date is None:
             as_of_date = date.today()
         
-        # Get all purchase items for this product up to the given date
-        purchase_items = self.db.query(PurchaseBillItem).join(
-            PurchaseBillItem.purchase_bill
-        ).options(
-            joinedload(PurchaseBillItem.purchase_bill)
-        ).filter(
-            PurchaseBillItem.product_id == product_id,
-            PurchaseBill.purchase_bill.business_id == business_id,
-            PurchaseBill.purchase_bill.bill_date <= as_of_date
-        ).order_by(PurchaseBill.purchase_bill.bill_date, PurchaseBillItem.id).all()
-        
-        # Build cost layers from purchases
-        cost_layers: List[InventoryCostLayer] = []
-        
-        for item in purchase_items:
-            net_quantity = item.quantity - (item.returned_quantity or Decimal("0"))
-            if net_quantity > 0:
-                unit_cost = item.price  # Use purchase price as unit cost
-                cost_layers.append(InventoryCostLayer(
-                    quantity=net_quantity,
-                    unit_cost=unit_cost,
-                    date=item.purchase_bill.bill_date,
-                    reference=item.purchase_bill.bill_number
-                ))
-        
-        # Get sales items to consume layers
-        sales_items = self.db.query(SalesInvoiceItem).join(
-            SalesInvoiceItem.sales_invoice
-        ).filter(
-            SalesInvoiceItem.product_id == product_id,
-            SalesInvoice.sales_invoice.business_id == business_id,
-            SalesInvoice.sales_invoice.invoice_date <= as_of_date
-        ).order_by(SalesInvoice.sales_invoice.invoice_date, SalesInvoiceItem.id).all()
-        
-        # Consume layers based on sales (FIFO)
-        for sale in sales_items:
-            remaining_to_consume = sale.quantity - (sale.returned_quantity or Decimal("0"))
-            
-            for layer in cost_layers:
-                if remaining_to_consume <= 0:
-                    break
-                if layer.quantity > 0:
-                    consume_amount = min(layer.quantity, remaining_to_consume)
-                    layer.quantity -= consume_amount
-                    remaining_to_consume -= consume_amount
-        
-        # Calculate remaining inventory value
-        remaining_quantity = Decimal("0")
-        remaining_value = Decimal("0")
-        
-        for layer in cost_layers:
-            if layer.quantity > 0:
-                remaining_quantity += layer.quantity
-                remaining_value += layer.quantity * layer.unit_cost
+        cost_layers = self._get_open_layers([product_id], business_id, as_of_date)[product_id]
         
         # Calculate cost for the requested quantity
-        cost = Decimal("0")
-        remaining_to_cost = quantity
-        
-        for layer in cost_layers:
-            if remaining_to_cost <= 0:
-                break
-            if layer.quantity > 0:
-                use_amount = min(layer.quantity, remaining_to_cost)
-                cost += use_amount * layer.unit_cost
-                remaining_to_cost -= use_amount
-        
-        return cost
+        return _cost_from_layers(cost_layers, quantity)
     
     def calculate_weighted_average_cost(self, product_id: int, business_id: int,
                                         as_of_date: date = None) -> Decimal:
@@ -115,47 +259,11 @@ class InventoryValuationService:
         if as_of_date is None:
             as_of_date = date.today()
         
-        # Get all purchase items for this product up to the given date
-        purchase_items = self.db.query(PurchaseBillItem).join(
-            PurchaseBillItem.purchase_bill
-        ).filter(
-            PurchaseBillItem.product_id == product_id,
-            PurchaseBill.purchase_bill.business_id == business_id,
-            PurchaseBill.purchase_bill.bill_date <= as_of_date
-        ).all()
-        
-        # Calculate total quantity and total cost
-        total_quantity = Decimal("0")
-        total_cost = Decimal("0")
-        
-        for item in purchase_items:
-            net_quantity = item.quantity - (item.returned_quantity or Decimal("0"))
-            if net_quantity > 0:
-                total_quantity += net_quantity
-                total_cost += net_quantity * item.price
-        
-        # Get sales items to get remaining quantity
-        sales_items = self.db.query(SalesInvoiceItem).join(
-            SalesInvoiceItem.sales_invoice
-        ).filter(
-            SalesInvoiceItem.product_id == product_id,
-            SalesInvoice.sales_invoice.business_id == business_id,
-            SalesInvoice.sales_invoice.invoice_date <= as_of_date
-        ).all()
-        
-        sold_quantity = Decimal("0")
-        for sale in sales_items:
-            sold_quantity += sale.quantity - (sale.returned_quantity or Decimal("0"))
+        key = (product_id, business_id, as_of_date)
+        if key in self._wac_cache:
+            return self._wac_cache[key]
         
-        remaining_quantity = total_quantity - sold_quantity
-        
-        # Calculate weighted average cost per unit
-        if total_quantity > 0:
-            average_cost_per_unit = total_cost / total_quantity
-        else:
-            average_cost_per_unit = Decimal("0")
-        
-        return average_cost_per_unit
+        return self._get_weighted_average_costs([product_id], business_id, as_of_date)[product_id]
     
     def calculate_inventory_value(self, product_id: int, business_id: int, branch_id: int,
                                   method: str = 'fifo', as_of_date: date = None) -> Dict:
@@ -175,15 +283,14 @@ class InventoryValuationService:
         if as_of_date is None:
             as_of_date = date.today()
         
-        product = self.db.query(Product).filter(
-            Product.id == product_id,
-            Product.business_id == business_id
-        ).first()
+        product = self.db.get(Product, product_id)
         
-        if not product:
+        if product is None or product.business_id != business_id:
             return {"error": "Product not found"}
         
-        current_quantity = product.stock_quantity
+        # Nothing on hand to value, so skip the cost lookup entirely
+        if not product.stock_quantity:
+            return self._value_info(product, Decimal("0"), method, as_of_date)
         
         if method == 'fifo':
             # For FIFO, we need to track layers
@@ -191,10 +298,14 @@ class InventoryValuationService:
         else:  # weighted_average
             unit_cost = self.calculate_weighted_average_cost(product_id, business_id, as_of_date)
         
+        return self._value_info(product, unit_cost, method, as_of_date)
+    
+    def _value_info(self, product: Product, unit_cost: Decimal, method: str, as_of_date: date) -> Dict:
+        current_quantity = product.stock_quantity
         total_value = current_quantity * unit_cost
         
         return {
-            "product_id": product_id,
+            "product_id": product.id,
             "product_name": product.name,
             "quantity": float(current_quantity),
             "unit_cost": float(unit_cost),
@@ -205,60 +316,11 @@ class InventoryValuationService:
     
     def _get_fifo_unit_cost(self, product_id: int, business_id: int, as_of_date: date) -> Decimal:
         """Get the average unit cost for remaining inventory using FIFO"""
-        # Get all purchase items for this product up to the given date
-        purchase_items = self.db.query(PurchaseBillItem).join(
-            PurchaseBillItem.purchase_bill
-        ).options(
-            joinedload(PurchaseBillItem.purchase_bill)
-        ).filter(
-            PurchaseBillItem.product_id == product_id,
-            PurchaseBill.purchase_bill.business_id == business_id,
-            PurchaseBill.purchase_bill.bill_date <= as_of_date
-        ).order_by(PurchaseBill.purchase_bill.bill_date, PurchaseBillItem.id).all()
-        
-        # Build and consume layers
-        cost_layers = []
-        
-        for item in purchase_items:
-            net_quantity = item.quantity - (item.returned_quantity or Decimal("0"))
-            if net_quantity > 0:
-                cost_layers.append({
-                    "quantity": net_quantity,
-                    "unit_cost": item.price
-                })
-        
-        # Get sales items to consume layers
-        sales_items = self.db.query(SalesInvoiceItem).join(
-            SalesInvoiceItem.sales_invoice
-        ).filter(
-            SalesInvoiceItem.product_id == product_id,
-            SalesInvoice.sales_invoice.business_id == business_id,
-            SalesInvoice.sales_invoice.invoice_date <= as_of_date
-        ).order_by(SalesInvoice.sales_invoice.invoice_date, SalesInvoiceItem.id).all()
-        
-        for sale in sales_items:
-            remaining = sale.quantity - (sale.returned_quantity or Decimal("0"))
-            
-            for layer in cost_layers:
-                if remaining <= 0:
-                    break
-                if layer["quantity"] > 0:
-                    consume = min(layer["quantity"], remaining)
-                    layer["quantity"] -= consume
-                    remaining -= consume
-        
-        # Calculate weighted average of remaining layers
-        total_value = Decimal("0")
-        total_quantity = Decimal("0")
-        
-        for layer in cost_layers:
-            if layer["quantity"] > 0:
-                total_value += layer["quantity"] * layer["unit_cost"]
-                total_quantity += layer["quantity"]
-        
-        if total_quantity > 0:
-            return total_value / total_quantity
-        return Decimal("0")
+        key = (product_id, business_id, as_of_date)
+        if key not in self._fifo_cache:
+            cost_layers = self._get_open_layers([product_id], business_id, as_of_date)[product_id]
+            self._fifo_cache[key] = _fifo_unit_cost(cost_layers)
+        return self._fifo_cache[key]
     
     def get_inventory_valuation_report(self, business_id: int, branch_id: int,
                                        method: str = 'fifo', 
@@ -272,7 +334,9 @@ class InventoryValuationService:
         if as_of_date is None:
             as_of_date = date.today()
         
-        query = self.db.query(Product).filter(
+        query = self.db.query(Product).options(
+            joinedload(Product.category)
+        ).filter(
             Product.business_id == business_id,
             Product.is_active == True,
             Product.stock_quantity > 0
@@ -283,29 +347,36 @@ class InventoryValuationService:
         
         products = query.all()
         
-        items = []
-        total_value = Decimal("0")
-        total_quantity = Decimal("0")
+        # Load the costing inputs of every product up front
+        product_ids = [p.id for p in products]
+        if method == 'fifo':
+            open_layers = self._get_open_layers(product_ids, business_id, as_of_date)
+        else:
+            average_costs = self._get_weighted_average_costs(product_ids, business_id, as_of_date)
         
+        # Value every product in Decimal; convert to float once when serializing
+        valued = []
         for product in products:
-            value_info = self.calculate_inventory_value(
-                product.id, business_id, branch_id, method, as_of_date
-            )
-            
-            if "error" not in value_info:
-                items.append({
-                    "product_id": product.id,
-                    "product_name": product.name,
-                    "sku": product.sku,
-                    "category": product.category.name if product.category else None,
-                    "quantity": value_info["quantity"],
-                    "unit_cost": value_info["unit_cost"],
-                    "total_value": value_info["total_value"],
-                    "purchase_price": float(product.purchase_price),
-                    "sales_price": float(product.sales_price)
-                })
-                total_value += Decimal(str(value_info["total_value"]))
-                total_quantity += Decimal(str(value_info["quantity"]))
+            if method == 'fifo':
+                unit_cost = _fifo_unit_cost(open_layers[product.id])
+            else:
+                unit_cost = average_costs[product.id]
+            valued.append((product, unit_cost, product.stock_quantity * unit_cost))
+        
+        total_quantity = sum((product.stock_quantity for product, _, _ in valued), Decimal("0"))
+        total_value = sum((value for _, _, value in valued), Decimal("0"))
+        
+        items = [{
+            "product_id": product.id,
+            "product_name": product.name,
+            "sku": product.sku,
+            "category": product.category.name if product.category else None,
+            "quantity": float(product.stock_quantity),
+            "unit_cost": float(unit_cost),
+            "total_value": float(value),
+            "purchase_price": float(product.purchase_price),
+            "sales_price": float(product.sales_price)
+        } for product, unit_cost, value in valued]
         
         return {
             "as_of_date": as_of_date.isoformat(),
@@ -318,24 +389,86 @@ class InventoryValuationService:
             }
         }
     
+    def _accounts_for(self, business_id: int) -> Dict[str, Optional[Account]]:
+        """Inventory, COGS and cash accounts of a business, looked up once per instance"""
+        if business_id not in self._accounts_cache:
+            accounts = self.db.query(Account).filter(
+                Account.business_id == business_id,
+                or_(
+                    Account.name == "Inventory",
+                    Account.name == "Cost of Goods Sold",
+                    Account.name.ilike("%Cash%")
+                )
+            ).order_by(Account.id).all()
+            
+            resolved = {"inventory": None, "cogs": None, "cash": None}
+            for account in accounts:
+                if account.name == "Inventory":
+                    resolved["inventory"] = resolved["inventory"] or account
+                elif account.name == "Cost of Goods Sold":
+                    resolved["cogs"] = resolved["cogs"] or account
+                if "cash" in account.name.lower():
+                    resolved["cash"] = resolved["cash"] or account
+            self._accounts_cache[business_id] = resolved
+        return self._accounts_cache[business_id]
+    
     def calculate_cogs_for_sale(self, product_id: int, quantity: Decimal,
-                                business_id: int, method: str = 'fifo') -> Decimal:
+                                business_id: int, method: str = 'fifo',
+                                as_of_date: date = None) -> Decimal:
         """
         Calculate the Cost of Goods Sold for a specific sale quantity.
         
         This is used when creating a sales invoice to determine the COGS amount.
+        Use one service instance per invoice: unit costs are memoized on it, so
+        repeated lines of a product reuse the cost instead of re-querying.
         """
+        if not quantity:
+            return Decimal("0")
+        
         if method == 'fifo':
-            return self.calculate_fifo_cost(product_id, business_id, None, quantity)
+            return self.calculate_fifo_cost(product_id, business_id, None, quantity, as_of_date)
         else:
-            avg_cost = self.calculate_weighted_average_cost(product_id, business_id)
+            avg_cost = self.calculate_weighted_average_cost(product_id, business_id, as_of_date)
             return quantity * avg_cost
     
+    def calculate_cogs_for_sale_batch(self, items: List[Tuple[int, Decimal]], business_id: int,
+                                      method: str = 'fifo', as_of_date: date = None) -> Dict[int, Decimal]:
+        """
+        Calculate the Cost of Goods Sold for every line of a sale at once.
+        
+        Takes (product_id, quantity) pairs and returns the COGS per product id.
+        Lines for the same product are costed together.
+        """
+        if as_of_date is None:
+            as_of_date = date.today()
+        
+        quantities: Dict[int, Decimal] = defaultdict(Decimal)
+        for product_id, quantity in items:
+            quantities[product_id] += quantity
+        
+        if not quantities:
+            return {}
+        
+        product_ids = list(quantities)
+        if method == 'fifo':
+            open_layers = self._get_open_layers(product_ids, business_id, as_of_date)
+            return {
+                product_id: _cost_from_layers(open_layers[product_id], quantity)
+                for product_id, quantity in quantities.items()
+            }
+        
+        average_costs = self._get_weighted_average_costs(product_ids, business_id, as_of_date)
+        return {
+            product_id: quantity * average_costs[product_id]
+            for product_id, quantity in quantities.items()
+        }
+    
     def create_inventory_ledger_entries(self, product_id: int, quantity_change: Decimal,
                                         transaction_type: str, transaction_date: date,
                                         business_id: int, branch_id: int,
                                         reference: str = None, 
-                                        method: str = 'fifo') -> List[LedgerEntry]:
+                                        method: str = 'fifo',
+                                        product: Optional[Product] = None) -> List[LedgerEntry]:
         """
         Create inventory and COGS ledger entries for a transaction.
         
@@ -348,33 +481,21 @@ class InventoryValuationService:
             branch_id: Branch ID
             reference: Reference number (invoice/bill number)
             method: Valuation method
+            product: The already-loaded product, if the caller has it
         
         Returns:
             List of LedgerEntry objects (not yet saved to DB)
         """
-        product = self.db.query(Product).filter(
-            Product.id == product_id,
-            Product.business_id == business_id
-        ).first()
+        if product is None:
+            product = self.db.get(Product, product_id)
         
-        if not product:
+        if product is None or product.business_id != business_id:
             raise ValueError("Product not found")
         
         # Get inventory and COGS accounts
-        inventory_account = self.db.query(Account).filter(
-            Account.business_id == business_id,
-            Account.name == "Inventory"
-        ).first()
-        
-        cogs_account = self.db.query(Account).filter(
-            Account.business_id == business_id,
-            Account.name == "Cost of Goods Sold"
-        ).first()
-        
-        cash_account = self.db.query(Account).filter(
-            Account.business_id == business_id,
-            Account.name.ilike("%Cash%")
-        ).first()
+        accounts = self._accounts_for(business_id)
+        inventory_account = accounts["inventory"]
+        cogs_account = accounts["cogs"]
         
         entries = []
         
@@ -390,8 +511,7 @@ class InventoryValuationService:
                     debit=total_cost,
                     credit=Decimal("0"),
                     account_id=inventory_account.id,
-                    branch_id=branch_id,
-                    business_id=business_id
+                    branch_id=branch_id
                 ))
         else:
             # Sale - record COGS
@@ -408,8 +528,7 @@ class InventoryValuationService:
                     debit=cogs_amount,
                     credit=Decimal("0"),
                     account_id=cogs_account.id,
-                    branch_id=branch_id,
-                    business_id=business_id
+                    branch_id=branch_id
                 ))
                 
                 # Credit Inventory
@@ -419,8 +538,7 @@ class InventoryValuationService:
                     debit=Decimal("0"),
                     credit=cogs_amount,
                     account_id=inventory_account.id,
-                    branch_id=branch_id,
-                    business_id=business_id
+                    branch_id=branch_id
                 ))
         
         return entries
@@ -431,6 +549,7 @@ class InventoryMovementService:
     
     def __init__(self, db: Session):
         self.db = db
+        self.valuation_service = InventoryValuationService(db)
     
     def get_product_movements(self, product_id: int, business_id: int,
                               start_date: date = None, end_date: date = None) -> List[Dict]:
@@ -439,87 +558,40 @@ class InventoryMovementService:
         
         Returns list of movements with quantity, cost, and running balance.
         """
-        from app.models import PurchaseBill, SalesInvoice
-        
-        movements = []
-        running_quantity = Decimal("0")
-        running_value = Decimal("0")
-        
-        # Get purchases
-        purchases = self.db.query(PurchaseBillItem).join(
-            PurchaseBillItem.purchase_bill
-        ).options(
-            joinedload(PurchaseBillItem.purchase_bill),
-            joinedload(PurchaseBillItem.product)
-        ).filter(
-            PurchaseBillItem.product_id == product_id,
-            PurchaseBill.purchase_bill.business_id == business_id
-        )
-        
-        if start_date:
-            purchases = purchases.filter(PurchaseBill.purchase_bill.bill_date >= start_date)
-        if end_date:
-            purchases = purchases.filter(PurchaseBill.purchase_bill.bill_date <= end_date)
-        
-        for item in purchases.all():
-            net_qty = item.quantity - (item.returned_quantity or Decimal("0"))
-            if net_qty > 0:
-                cost = net_qty * item.price
-                running_quantity += net_qty
-                running_value += cost
-                
-                movements.append({
-                    "date": item.purchase_bill.bill_date.isoformat(),
-                    "type": "purchase",
-                    "reference": item.purchase_bill.bill_number,
-                    "quantity_in": float(net_qty),
-                    "quantity_out": 0,
-                    "unit_cost": float(item.price),
-                    "total_cost": float(cost),
-                    "balance_quantity": float(running_quantity),
-                    "balance_value": float(running_value)
-                })
-        
-        # Get sales
-        sales = self.db.query(SalesInvoiceItem).join(
-            SalesInvoiceItem.sales_invoice
-        ).options(
-            joinedload(SalesInvoiceItem.sales_invoice),
-            joinedload(SalesInvoiceItem.product)
-        ).filter(
-            SalesInvoiceItem.product_id == product_id,
-            SalesInvoice.sales_invoice.business_id == business_id
-        )
-        
-        if start_date:
-            sales = sales.filter(SalesInvoice.sales_invoice.invoice_date >= start_date)
-        if end_date:
-            sales = sales.filter(SalesInvoice.sales_invoice.invoice_date <= end_date)
-        
         # Get average cost for COGS calculation
-        valuation_service = InventoryValuationService(self.db)
-        avg_cost = valuation_service.calculate_weighted_average_cost(product_id, business_id)
-        
-        for item in sales.all():
-            net_qty = item.quantity - (item.returned_quantity or Decimal("0"))
-            if net_qty > 0:
-                cost = net_qty * avg_cost
-                running_quantity -= net_qty
-                running_value -= cost
-                
-                movements.append({
-                    "date": item.sales_invoice.invoice_date.isoformat(),
-                    "type": "sale",
-                    "reference": item.sales_invoice.invoice_number,
-                    "quantity_in": 0,
-                    "quantity_out": float(net_qty),
-                    "unit_cost": float(avg_cost),
-                    "total_cost": float(cost),
-                    "balance_quantity": float(running_quantity),
-                    "balance_value": float(running_value)
-                })
-        
-        # Sort by date
-        movements.sort(key=lambda x: x["date"])
+        avg_cost = self.valuation_service.calculate_weighted_average_cost(product_id, business_id)
+        
+        history = _history_union([product_id], business_id, start_date, end_date).subquery()
+        is_purchase = history.c.kind == 'P'
+        net_qty = history.c.net_qty
+        # Float, not the price column's Numeric(15, 2), so the average cost keeps its precision
+        unit_cost = type_coerce(case((is_purchase, history.c.price), else_=literal(avg_cost)), Float)
+        signed_qty = case((is_purchase, net_qty), else_=-net_qty)
+        
+        # Running balances are window sums in date order, purchases first on the same day
+        running = {"order_by": (history.c.entry_date, history.c.kind, history.c.item_id),
+                   "rows": (None, 0)}
+        query = select(
+            history.c.kind,
+            history.c.entry_date,
+            history.c.reference,
+            net_qty,
+            unit_cost.label('unit_cost'),
+            (net_qty * unit_cost).label('total_cost'),
+            func.sum(signed_qty).over(**running).label('balance_quantity'),
+            func.sum(signed_qty * unit_cost).over(**running).label('balance_value')
+        ).order_by(*running["order_by"])
+        
+        movements = [{
+            "date": row.entry_date.isoformat(),
+            "type": "purchase" if row.kind == 'P' else "sale",
+            "reference": row.reference,
+            "quantity_in": float(row.net_qty) if row.kind == 'P' else 0,
+            "quantity_out": 0 if row.kind == 'P' else float(row.net_qty),
+            "unit_cost": float(row.unit_cost),
+            "total_cost": float(row.total_cost),
+            "balance_quantity": float(row.balance_quantity),
+            "balance_value": float(row.balance_value)
+        } for row in self.db.execute(query)]
         
         return movements
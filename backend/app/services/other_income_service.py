@@ -3,11 +3,12 @@ Other Income Service - Manage non-sales income (interest, rent, dividends, etc.)
 """
 from typing import Optional, List, Dict
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, select, insert, delete, exists, union_all, null
 from decimal import Decimal
 from datetime import date
 
-from app.models import OtherIncome, Account, AccountType, LedgerEntry, Customer, CashBookEntry
+from app.models import OtherIncome, Account, AccountType, LedgerEntry, Customer, CashBookEntry, BankAccount
+from app.utils.numbering import last_number_query, number_after, next_number
 
 
 class OtherIncomeService:
@@ -25,15 +26,23 @@ class OtherIncomeService:
         return query.first()
     
     def get_by_branch(self, branch_id: int, business_id: int, category: str = None, 
-                      start_date: date = None, end_date: date = None) -> List[OtherIncome]:
-        """Get all other incomes for a branch with optional filters"""
+                      start_date: date = None, end_date: date = None,
+                      exact_category: bool = False) -> List[OtherIncome]:
+        """Get all other incomes for a branch with optional filters.
+        
+        With exact_category the category is matched with equality (index-friendly)
+        instead of a substring search.
+        """
         query = self.db.query(OtherIncome).filter(
             OtherIncome.branch_id == branch_id,
             OtherIncome.business_id == business_id
         )
         
         if category:
-            query = query.filter(OtherIncome.category.ilike(f"%{category}%"))
+            if exact_category:
+                query = query.filter(OtherIncome.category == category)
+            else:
+                query = query.filter(OtherIncome.category.ilike(f"%{category}%"))
         if start_date:
             query = query.filter(OtherIncome.income_date >= start_date)
         if end_date:
@@ -48,18 +57,7 @@ class OtherIncomeService:
     
     def get_next_number(self, business_id: int) -> str:
         """Get next income number"""
-        last_income = self.db.query(OtherIncome).filter(
-            OtherIncome.business_id == business_id
-        ).order_by(OtherIncome.id.desc()).first()
-        
-        if last_income:
-            try:
-                num = int(last_income.income_number.replace("INC-", ""))
-                return f"INC-{num + 1:05d}"
-            except ValueError:
-                pass
-        
-        return "INC-00001"
+        return next_number(self.db, OtherIncome.income_number, OtherIncome.business_id, business_id, "INC")
     
     def create(self, income_data, business_id: int, branch_id: int) -> OtherIncome:
         """Create a new other income with ledger entries and cash book entry"""
@@ -68,26 +66,25 @@ class OtherIncomeService:
         vat_amount = income_data.vat_amount or Decimal("0.00")
         total_amount = sub_total + vat_amount
         
-        # Get income account (revenue type account to record the income)
-        income_account = self.db.query(Account).filter(
-            Account.id == income_data.income_account_id,
-            Account.business_id == business_id
-        ).first()
+        # Load the income (revenue) and receiving (cash/bank) accounts together,
+        # with whether each is linked to a bank account
+        has_bank_account = exists().where(BankAccount.chart_of_account_id == Account.id)
+        accounts = {
+            acc.id: (acc, is_bank) for acc, is_bank in self.db.query(Account, has_bank_account).filter(
+                Account.id.in_([income_data.income_account_id, income_data.received_in_account_id]),
+                Account.business_id == business_id
+            ).all()
+        }
         
-        if not income_account:
+        if income_data.income_account_id not in accounts:
             raise ValueError("Invalid income account")
         
-        # Get receiving account (cash/bank account to receive funds)
-        receiving_account = self.db.query(Account).filter(
-            Account.id == income_data.received_in_account_id,
-            Account.business_id == business_id
-        ).first()
-        
-        if not receiving_account:
+        if income_data.received_in_account_id not in accounts:
             raise ValueError("Invalid receiving account")
+        receiving_account, receiving_is_bank = accounts[income_data.received_in_account_id]
         
-        # Create other income record
-        income = OtherIncome(
+        # Create other income record; RETURNING hands back the row with its id
+        income = self.db.scalar(insert(OtherIncome).values(
             income_number=self.get_next_number(business_id),
             income_date=income_data.income_date,
             category=income_data.category,
@@ -100,82 +97,66 @@ class OtherIncomeService:
             income_account_id=income_data.income_account_id,
             branch_id=branch_id,
             business_id=business_id
-        )
-        self.db.add(income)
-        self.db.flush()
+        ).returning(OtherIncome))
+        
+        # Create CashBook entry (its balance is read before this income is posted)
+        self._create_cashbook_entry(income, receiving_account, branch_id, business_id, receiving_is_bank)
+        
+        # Create ledger entries for double-entry accounting:
+        # debit the receiving account (increases cash/bank), credit the income account (increases revenue)
+        description = f"Income: {income_data.category} - {income_data.description or ''}"
+        self.db.execute(insert(LedgerEntry), [
+            {
+                'transaction_date': income_data.income_date,
+                'description': description,
+                'reference': income.income_number,
+                'debit': debit,
+                'credit': credit,
+                'account_id': account_id,
+                'other_income_id': income.id,
+                'branch_id': branch_id
+            }
+            for account_id, debit, credit in (
+                (income_data.received_in_account_id, total_amount, Decimal("0.00")),
+                (income_data.income_account_id, Decimal("0.00"), total_amount)
+            )
+        ])
         
-        # Create ledger entries for double-entry accounting
-        # Debit the receiving account (increases cash/bank)
-        debit_entry = LedgerEntry(
-            transaction_date=income_data.income_date,
-            description=f"Income: {income_data.category} - {income_data.description or ''}",
-            reference=income.income_number,
-            debit=total_amount,
-            credit=Decimal("0.00"),
-            account_id=income_data.received_in_account_id,
-            other_income_id=income.id,
-            branch_id=branch_id
-        )
-        self.db.add(debit_entry)
-        
-        # Credit the income account (increases revenue)
-        credit_entry = LedgerEntry(
-            transaction_date=income_data.income_date,
-            description=f"Income: {income_data.category} - {income_data.description or ''}",
-            reference=income.income_number,
-            debit=Decimal("0.00"),
-            credit=total_amount,
-            account_id=income_data.income_account_id,
-            other_income_id=income.id,
-            branch_id=branch_id
-        )
-        self.db.add(credit_entry)
-        
-        # Create CashBook entry
-        self._create_cashbook_entry(income, receiving_account, branch_id, business_id)
-        
-        self.db.flush()
         return income
     
     def _create_cashbook_entry(self, income: OtherIncome, receiving_account: Account, 
-                               branch_id: int, business_id: int):
+                               branch_id: int, business_id: int, has_bank_account: bool = False):
         """Create a cash book entry for other income"""
-        from app.models import CashBookEntry
-        from sqlalchemy import func as sql_func
-        
         # Determine account type (cash or bank)
         account_type = "cash"
-        if hasattr(receiving_account, 'bank_accounts') and receiving_account.bank_accounts:
+        if has_bank_account:
             account_type = "bank"
         elif receiving_account.name and 'bank' in receiving_account.name.lower():
             account_type = "bank"
         
-        # Get current balance from ledger
-        current_balance = self.db.query(
+        # Get current balance from ledger, the last receipt number and the payer's name in one round-trip
+        prefix = "CR"  # Cash Receipt
+        balance_q = self.db.query(
             func.sum(LedgerEntry.debit - LedgerEntry.credit)
         ).filter(
             LedgerEntry.account_id == receiving_account.id,
             LedgerEntry.branch_id == branch_id
-        ).scalar() or Decimal("0")
+        ).scalar_subquery()
+        last_number_q = last_number_query(
+            self.db, CashBookEntry.entry_number, CashBookEntry.business_id, business_id, prefix
+        ).scalar_subquery()
+        customer_name_q = self.db.query(Customer.name).filter(
+            Customer.id == income.customer_id,
+            Customer.business_id == business_id
+        ).scalar_subquery()
+        current_balance, last_number, customer_name = self.db.query(balance_q, last_number_q, customer_name_q).one()
+        current_balance = current_balance or Decimal("0")
         
         # Generate entry number
-        prefix = "CR"  # Cash Receipt
-        last_entry = self.db.query(CashBookEntry).filter(
-            CashBookEntry.business_id == business_id,
-            CashBookEntry.entry_number.like(f'{prefix}-%')
-        ).order_by(CashBookEntry.id.desc()).first()
-        
-        if last_entry:
-            try:
-                num = int(last_entry.entry_number.replace(f'{prefix}-', ''))
-                entry_number = f'{prefix}-{num + 1:05d}'
-            except ValueError:
-                entry_number = f'{prefix}-00001'
-        else:
-            entry_number = f'{prefix}-00001'
+        entry_number = number_after(prefix, last_number)
         
         # Create cash book entry
-        cashbook_entry = CashBookEntry(
+        self.db.execute(insert(CashBookEntry).values(
             entry_number=entry_number,
             entry_date=income.income_date,
             entry_type="receipt",
@@ -185,13 +166,12 @@ class OtherIncomeService:
             balance_after=current_balance,
             description=f"Other Income: {income.category} - {income.description or ''}",
             reference=income.income_number,
-            payee_payer=income.customer.name if income.customer else income.category,
+            payee_payer=customer_name or income.category,
             source_type="other_income",
             source_id=income.id,
             branch_id=branch_id,
             business_id=business_id
-        )
-        self.db.add(cashbook_entry)
+        ))
     
     def update(self, income_id: int, business_id: int, branch_id: int, income_data) -> Optional[OtherIncome]:
         """Update an other income"""
@@ -215,53 +195,51 @@ class OtherIncomeService:
     
     def delete(self, income_id: int, business_id: int, branch_id: int = None) -> bool:
         """Delete an other income"""
-        income = self.get_by_id(income_id, business_id, branch_id)
-        if not income:
-            return False
+        filters = [OtherIncome.id == income_id, OtherIncome.business_id == business_id]
+        if branch_id:
+            filters.append(OtherIncome.branch_id == branch_id)
         
-        # Delete associated ledger entries
-        self.db.query(LedgerEntry).filter(LedgerEntry.other_income_id == income.id).delete()
+        # Delete associated ledger entries first; the FK would otherwise null them out
+        self.db.execute(
+            delete(LedgerEntry).where(
+                LedgerEntry.other_income_id.in_(select(OtherIncome.id).where(*filters))
+            )
+        )
         
-        self.db.delete(income)
-        return True
+        return self.db.execute(delete(OtherIncome).where(*filters)).rowcount > 0
     
     def get_categories(self, business_id: int) -> List[str]:
         """Get list of income categories used by the business"""
-        results = self.db.query(OtherIncome.category).filter(
-            OtherIncome.business_id == business_id
-        ).distinct().all()
-        return [r[0] for r in results]
+        return self.db.scalars(
+            select(OtherIncome.category).where(
+                OtherIncome.business_id == business_id
+            ).distinct().order_by(OtherIncome.category)
+        ).all()
     
     def get_income_summary(self, business_id: int, branch_id: int, 
                            start_date: date = None, end_date: date = None) -> Dict:
         """Get income summary by category"""
-        query = self.db.query(
-            OtherIncome.category,
-            func.sum(OtherIncome.amount).label("total")
-        ).filter(
+        filters = [
             OtherIncome.business_id == business_id,
             OtherIncome.branch_id == branch_id
-        )
-        
+        ]
         if start_date:
-            query = query.filter(OtherIncome.income_date >= start_date)
+            filters.append(OtherIncome.income_date >= start_date)
         if end_date:
-            query = query.filter(OtherIncome.income_date <= end_date)
-        
-        results = query.group_by(OtherIncome.category).all()
+            filters.append(OtherIncome.income_date <= end_date)
         
-        categories = []
-        total = Decimal("0.00")
-        for r in results:
-            categories.append({
-                "category": r.category,
-                "total": float(r.total)
-            })
-            total += r.total
+        # Per-category totals plus a grand-total row (category NULL) in one result set
+        total = func.coalesce(func.sum(OtherIncome.amount), 0).label("total")
+        by_category = select(OtherIncome.category, total).where(*filters).group_by(OtherIncome.category)
+        grand_total = select(null().label("category"), total).where(*filters)
+        results = self.db.execute(union_all(by_category, grand_total)).all()
         
         return {
-            "categories": categories,
-            "total": float(total)
+            "categories": [
+                {"category": r.category, "total": float(r.total)}
+                for r in results if r.category is not None
+            ],
+            "total": next(float(r.total) for r in results if r.category is None)
         }
     
     def get_customer(self, customer_id: int, business_id: int) -> Optional[Customer]:
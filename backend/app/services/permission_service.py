@@ -1,9 +1,27 @@
 """
 Permission Service - Business Logic for RBAC
 """
-from typing import List, Set
+import threading
+from collections import defaultdict
+from typing import List, Set, Dict
+from sqlalchemy import insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
-from app.models import Permission, Role, RolePermission, User
+from app.models import Permission, Role, RolePermission, User, UserBranchRole
+
+
+# Seeded permissions keep their ids, so the name -> id map is cached for the process
+# and only reloaded when a lookup asks for a name it has not seen (e.g. after seeding)
+_permission_ids_by_name: Dict[str, int] = {}
+_permission_ids_lock = threading.Lock()
+
+
+def invalidate_permission_cache(db: Session) -> None:
+    """Forget permission sets cached on users loaded in this session after role changes"""
+    for obj in list(db.identity_map.values()):
+        if isinstance(obj, User):
+            obj.__dict__.pop('_cached_permissions', None)
 
 
 class PermissionService:
@@ -13,39 +31,44 @@ class PermissionService:
     def get_all_permissions(self) -> List[Permission]:
         return self.db.query(Permission).all()
     
+    def name_to_id(self, permission_names: List[str]) -> Dict[str, int]:
+        """Map permission names to ids; names that do not exist are left out"""
+        with _permission_ids_lock:
+            if any(name not in _permission_ids_by_name for name in permission_names):
+                _permission_ids_by_name.clear()
+                _permission_ids_by_name.update(self.db.query(Permission.name, Permission.id).all())
+            return {
+                name: _permission_ids_by_name[name]
+                for name in permission_names if name in _permission_ids_by_name
+            }
+    
     def get_permissions_by_category(self) -> dict:
-        permissions = self.get_all_permissions()
-        categorized = {}
-        for perm in permissions:
-            if perm.category not in categorized:
-                categorized[perm.category] = []
+        categorized = defaultdict(list)
+        for perm in self.get_all_permissions():
             categorized[perm.category].append(perm)
-        return categorized
+        return dict(categorized)
     
     def get_user_permissions(self, user: User) -> Set[str]:
-        """Get all permissions for a user through their roles"""
-        permissions = set()
+        """
+        Get all permissions for a user through their roles.
         
-        # Debug: Make sure user has roles loaded
-        if not user.roles:
-            return permissions
+        The set is cached on the user object, which lives for one request,
+        so repeated checks in the same request cost a single query.
+        """
+        cached = getattr(user, '_cached_permissions', None)
+        if cached is not None:
+            return cached
         
-        for user_role in user.roles:
-            role = user_role.role
-            if not role:
-                continue
-            
-            # Get permissions through role.permission_links
-            if hasattr(role, 'permission_links') and role.permission_links:
-                for role_perm in role.permission_links:
-                    if role_perm.permission:
-                        permissions.add(role_perm.permission.name)
-            # Fallback: try role.permissions property
-            elif hasattr(role, 'permissions') and role.permissions:
-                for perm in role.permissions:
-                    permissions.add(perm.name)
+        names = self.db.query(Permission.name).join(
+            RolePermission, RolePermission.permission_id == Permission.id
+        ).join(
+            UserBranchRole, UserBranchRole.role_id == RolePermission.role_id
+        ).filter(
+            UserBranchRole.user_id == user.id
+        ).distinct().all()
         
-        return permissions
+        user._cached_permissions = {name for (name,) in names}
+        return user._cached_permissions
     
     def user_has_permission(self, user: User, permission_name: str) -> bool:
         """Check if user has a specific permission"""
@@ -53,9 +76,27 @@ class PermissionService:
         return permission_name in user_permissions
     
     def user_has_any_permission(self, user: User, permission_names: List[str]) -> bool:
-        """Check if user has any of the specified permissions"""
-        user_permissions = self.get_user_permissions(user)
-        return bool(set(permission_names) & user_permissions)
+        """
+        Check if user has any of the specified permissions.
+        
+        Uses the cached permission set when this request already loaded it,
+        otherwise asks the database with an EXISTS that stops at the first match.
+        """
+        cached = getattr(user, '_cached_permissions', None)
+        if cached is not None:
+            return not cached.isdisjoint(permission_names)
+        if not permission_names:
+            return False
+        
+        matches = self.db.query(Permission.id).join(
+            RolePermission, RolePermission.permission_id == Permission.id
+        ).join(
+            UserBranchRole, UserBranchRole.role_id == RolePermission.role_id
+        ).filter(
+            UserBranchRole.user_id == user.id,
+            Permission.name.in_(permission_names)
+        )
+        return self.db.query(matches.exists()).scalar()
 
 
 class RoleService:
@@ -97,12 +138,13 @@ class RoleService:
         self.db.flush()
         
         # Assign all permissions
-        permissions = self.db.query(Permission).all()
-        for perm in permissions:
-            role_perm = RolePermission(role_id=admin_role.id, permission_id=perm.id)
-            self.db.add(role_perm)
+        permission_ids = [perm_id for (perm_id,) in self.db.query(Permission.id).all()]
+        if permission_ids:
+            self.db.execute(insert(RolePermission), [
+                {"role_id": admin_role.id, "permission_id": perm_id}
+                for perm_id in permission_ids
+            ])
         
-        self.db.flush()
         return admin_role
     
     def update_permissions(self, role_id: int, permission_ids: List[int]) -> Role:
@@ -114,184 +156,205 @@ class RoleService:
         self.db.query(RolePermission).filter(RolePermission.role_id == role_id).delete()
         
         # Add new permissions
-        for perm_id in permission_ids:
-            role_perm = RolePermission(role_id=role.id, permission_id=perm_id)
-            self.db.add(role_perm)
+        if permission_ids:
+            self.db.execute(insert(RolePermission), [
+                {"role_id": role.id, "permission_id": perm_id}
+                for perm_id in permission_ids
+            ])
         
-        self.db.flush()
+        invalidate_permission_cache(self.db)
         return role
     
+    def update_permissions_by_name(self, role_id: int, permission_names: List[str]) -> Role:
+        """Replace a role's permissions, given by name, without querying their ids"""
+        permission_ids = PermissionService(self.db).name_to_id(permission_names)
+        unknown = [name for name in permission_names if name not in permission_ids]
+        if unknown:
+            raise ValueError(f"Unknown permissions: {', '.join(unknown)}")
+        return self.update_permissions(role_id, list(permission_ids.values()))
+    
     def delete(self, role_id: int) -> bool:
         role = self.get_by_id(role_id)
         if not role or role.is_system:
             return False
         
         self.db.delete(role)
+        invalidate_permission_cache(self.db)
         return True
 
 
-def seed_permissions(db: Session):
-    """Seed default permissions into the database"""
-    all_permissions = [
-        # Settings
-        {"name": "settings:edit", "category": "Settings", "description": "Edit business settings"},
-        # Users
-        {"name": "users:view", "category": "Users", "description": "View users list"},
-        {"name": "users:create", "category": "Users", "description": "Create new users"},
-        {"name": "users:edit", "category": "Users", "description": "Edit existing users"},
-        {"name": "users:delete", "category": "Users", "description": "Delete users"},
-        {"name": "users:assign-roles", "category": "Users", "description": "Assign roles to users"},
-        # Roles
-        {"name": "roles:view", "category": "Roles", "description": "View roles"},
-        {"name": "roles:create", "category": "Roles", "description": "Create new roles"},
-        {"name": "roles:edit", "category": "Roles", "description": "Edit existing roles"},
-        {"name": "roles:delete", "category": "Roles", "description": "Delete roles"},
-        # Branches
-        {"name": "branches:view", "category": "Branches", "description": "View branches"},
-        {"name": "branches:create", "category": "Branches", "description": "Create new branches"},
-        {"name": "branches:edit", "category": "Branches", "description": "Edit existing branches"},
-        {"name": "branches:delete", "category": "Branches", "description": "Delete branches"},
-        # Banking (template uses banking:view, transfers:view, reconciliation:view)
-        {"name": "banking:view", "category": "Banking", "description": "View bank accounts"},
-        {"name": "banking:create", "category": "Banking", "description": "Create bank accounts"},
-        {"name": "banking:edit", "category": "Banking", "description": "Edit bank accounts"},
-        {"name": "banking:delete", "category": "Banking", "description": "Delete bank accounts"},
-        {"name": "transfers:view", "category": "Banking", "description": "View fund transfers"},
-        {"name": "transfers:create", "category": "Banking", "description": "Create fund transfers"},
-        {"name": "reconciliation:view", "category": "Banking", "description": "View bank reconciliation"},
-        {"name": "reconciliation:create", "category": "Banking", "description": "Perform bank reconciliation"},
-        # Reports (template uses reports:view)
-        {"name": "reports:view", "category": "Reports", "description": "View reports"},
-        {"name": "reports:export", "category": "Reports", "description": "Export reports"},
-        # AI Analyst
-        {"name": "jarvis:ask", "category": "AI Analyst", "description": "Use AI assistant"},
-        # Customers
-        {"name": "customers:view", "category": "Customers", "description": "View customers"},
-        {"name": "customers:create", "category": "Customers", "description": "Create customers"},
-        {"name": "customers:edit", "category": "Customers", "description": "Edit customers"},
-        {"name": "customers:delete", "category": "Customers", "description": "Delete customers"},
-        # Vendors
-        {"name": "vendors:view", "category": "Vendors", "description": "View vendors"},
-        {"name": "vendors:create", "category": "Vendors", "description": "Create vendors"},
-        {"name": "vendors:edit", "category": "Vendors", "description": "Edit vendors"},
-        {"name": "vendors:delete", "category": "Vendors", "description": "Delete vendors"},
-        # Inventory (template uses products:view, categories:view, stock:view)
-        {"name": "products:view", "category": "Inventory", "description": "View products"},
-        {"name": "products:create", "category": "Inventory", "description": "Create products"},
-        {"name": "products:edit", "category": "Inventory", "description": "Edit products"},
-        {"name": "products:delete", "category": "Inventory", "description": "Delete products"},
-        {"name": "categories:view", "category": "Inventory", "description": "View categories"},
-        {"name": "categories:create", "category": "Inventory", "description": "Create categories"},
-        {"name": "categories:edit", "category": "Inventory", "description": "Edit categories"},
-        {"name": "categories:delete", "category": "Inventory", "description": "Delete categories"},
-        {"name": "stock:view", "category": "Inventory", "description": "View stock adjustments"},
-        {"name": "stock:create", "category": "Inventory", "description": "Create stock adjustments"},
-        # Purchases (template uses bills:view, bills:create, debit_notes:view)
-        {"name": "bills:view", "category": "Purchases", "description": "View purchase bills"},
-        {"name": "bills:create", "category": "Purchases", "description": "Create purchase bills"},
-        {"name": "bills:edit", "category": "Purchases", "description": "Edit purchase bills"},
-        {"name": "bills:delete", "category": "Purchases", "description": "Delete purchase bills"},
-        {"name": "debit_notes:view", "category": "Purchases", "description": "View debit notes"},
-        {"name": "debit_notes:create", "category": "Purchases", "description": "Create debit notes"},
-        {"name": "debit_notes:edit", "category": "Purchases", "description": "Edit and apply debit notes"},
-        # Sales (template uses invoices:view, invoices:create, credit_notes:view)
-        {"name": "invoices:view", "category": "Sales", "description": "View sales invoices"},
-        {"name": "invoices:create", "category": "Sales", "description": "Create sales invoices"},
-        {"name": "invoices:edit", "category": "Sales", "description": "Edit sales invoices"},
-        {"name": "invoices:delete", "category": "Sales", "description": "Delete sales invoices"},
-        {"name": "credit_notes:view", "category": "Sales", "description": "View credit notes"},
-        {"name": "credit_notes:create", "category": "Sales", "description": "Create credit notes"},
-        {"name": "credit_notes:edit", "category": "Sales", "description": "Edit and apply credit notes"},
-        # Expenses
-        {"name": "expenses:view", "category": "Expenses", "description": "View expenses"},
-        {"name": "expenses:create", "category": "Expenses", "description": "Create expenses"},
-        {"name": "expenses:edit", "category": "Expenses", "description": "Edit expenses"},
-        {"name": "expenses:delete", "category": "Expenses", "description": "Delete expenses"},
-        # Accounting (template uses accounts:view, journal:view)
-        {"name": "accounts:view", "category": "Accounting", "description": "View chart of accounts"},
-        {"name": "accounts:create", "category": "Accounting", "description": "Create accounts"},
-        {"name": "accounts:edit", "category": "Accounting", "description": "Edit accounts"},
-        {"name": "accounts:delete", "category": "Accounting", "description": "Delete accounts"},
-        {"name": "journal:view", "category": "Accounting", "description": "View journal entries"},
-        {"name": "journal:create", "category": "Accounting", "description": "Create journal entries"},
-        {"name": "journal:edit", "category": "Accounting", "description": "Edit journal entries"},
-        {"name": "journal:delete", "category": "Accounting", "description": "Delete journal entries"},
-        # HR (template uses employees:view, payroll:view)
-        {"name": "employees:view", "category": "HR", "description": "View employees"},
-        {"name": "employees:create", "category": "HR", "description": "Create employees"},
-        {"name": "employees:edit", "category": "HR", "description": "Edit employees"},
-        {"name": "employees:delete", "category": "HR", "description": "Delete employees"},
-        {"name": "payroll:view", "category": "HR", "description": "View payroll"},
-        {"name": "payroll:create", "category": "HR", "description": "Run payroll"},
-        # Budgeting
-        {"name": "budgets:view", "category": "Budgeting", "description": "View budgets"},
-        {"name": "budgets:create", "category": "Budgeting", "description": "Create budgets"},
-        {"name": "budgets:edit", "category": "Budgeting", "description": "Edit budgets"},
-        {"name": "budgets:delete", "category": "Budgeting", "description": "Delete budgets"},
-        # Other Income
-        {"name": "other_income:view", "category": "Other Income", "description": "View other income"},
-        {"name": "other_income:create", "category": "Other Income", "description": "Create other income"},
-        {"name": "other_income:edit", "category": "Other Income", "description": "Edit other income"},
-        {"name": "other_income:delete", "category": "Other Income", "description": "Delete other income"},
-        # Fixed Assets
-        {"name": "fixed_assets:view", "category": "Fixed Assets", "description": "View fixed assets"},
-        {"name": "fixed_assets:create", "category": "Fixed Assets", "description": "Create fixed assets"},
-        {"name": "fixed_assets:edit", "category": "Fixed Assets", "description": "Edit fixed assets"},
-        {"name": "fixed_assets:delete", "category": "Fixed Assets", "description": "Delete fixed assets"},
-        {"name": "fixed_assets:depreciate", "category": "Fixed Assets", "description": "Record depreciation"},
-        # Fiscal Year
-        {"name": "fiscal_year:view", "category": "Accounting", "description": "View fiscal years"},
-        {"name": "fiscal_year:create", "category": "Accounting", "description": "Create fiscal years"},
-        {"name": "fiscal_year:edit", "category": "Accounting", "description": "Edit fiscal years"},
-        {"name": "fiscal_year:close", "category": "Accounting", "description": "Close fiscal years"},
-        # Bank
-        {"name": "bank:create", "category": "Banking", "description": "Create bank accounts"},
-        {"name": "bank:edit", "category": "Banking", "description": "Edit bank accounts"},
-        {"name": "bank:delete", "category": "Banking", "description": "Delete bank accounts"},
-        {"name": "bank:reconcile", "category": "Banking", "description": "Perform bank reconciliation"},
-        # Inventory
-        {"name": "inventory:create", "category": "Inventory", "description": "Create inventory items"},
-        {"name": "inventory:edit", "category": "Inventory", "description": "Edit inventory items"},
-        {"name": "inventory:delete", "category": "Inventory", "description": "Delete inventory items"},
-        {"name": "inventory:adjust_stock", "category": "Inventory", "description": "Adjust stock levels"},
-        # Sales
-        {"name": "sales:create", "category": "Sales", "description": "Create sales invoices"},
-        {"name": "sales:edit", "category": "Sales", "description": "Edit sales invoices"},
-        {"name": "sales:delete", "category": "Sales", "description": "Delete sales invoices"},
-        # Purchases
-        {"name": "purchases:create", "category": "Purchases", "description": "Create purchase bills"},
-        {"name": "purchases:edit", "category": "Purchases", "description": "Edit purchase bills"},
-        {"name": "purchases:delete", "category": "Purchases", "description": "Delete purchase bills"},
-        # Credit Notes
-        {"name": "credit_notes:create", "category": "Sales", "description": "Create credit notes"},
-        {"name": "credit_notes:edit", "category": "Sales", "description": "Edit credit notes"},
-        # Debit Notes
-        {"name": "debit_notes:create", "category": "Purchases", "description": "Create debit notes"},
-        {"name": "debit_notes:edit", "category": "Purchases", "description": "Edit debit notes"},
-        # AI Assistant
-        {"name": "ai:use", "category": "AI Assistant", "description": "Use AI assistant for chat and analysis"},
-        {"name": "ai:configure", "category": "AI Assistant", "description": "Configure AI settings and providers"},
-        {"name": "ai:view_usage", "category": "AI Assistant", "description": "View AI usage statistics"},
-        # Agents
-        {"name": "agents:use", "category": "Agents", "description": "Use automation and audit agents"},
-        {"name": "agents:configure", "category": "Agents", "description": "Configure agent settings and schedules"},
-        {"name": "agents:view_findings", "category": "Agents", "description": "View agent findings and reports"},
-        {"name": "doc_wizard:use", "category": "Agents", "description": "Use the Doc Wizard for issue resolution"},
-    ]
+_PERMISSIONS_SEED = [
+    # Settings
+    {"name": "settings:edit", "category": "Settings", "description": "Edit business settings"},
+    # Users
+    {"name": "users:view", "category": "Users", "description": "View users list"},
+    {"name": "users:create", "category": "Users", "description": "Create new users"},
+    {"name": "users:edit", "category": "Users", "description": "Edit existing users"},
+    {"name": "users:delete", "category": "Users", "description": "Delete users"},
+    {"name": "users:assign-roles", "category": "Users", "description": "Assign roles to users"},
+    # Roles
+    {"name": "roles:view", "category": "Roles", "description": "View roles"},
+    {"name": "roles:create", "category": "Roles", "description": "Create new roles"},
+    {"name": "roles:edit", "category": "Roles", "description": "Edit existing roles"},
+    {"name": "roles:delete", "category": "Roles", "description": "Delete roles"},
+    # Branches
+    {"name": "branches:view", "category": "Branches", "description": "View branches"},
+    {"name": "branches:create", "category": "Branches", "description": "Create new branches"},
+    {"name": "branches:edit", "category": "Branches", "description": "Edit existing branches"},
+    {"name": "branches:delete", "category": "Branches", "description": "Delete branches"},
+    # Banking (template uses banking:view, transfers:view, reconciliation:view)
+    {"name": "banking:view", "category": "Banking", "description": "View bank accounts"},
+    {"name": "banking:create", "category": "Banking", "description": "Create bank accounts"},
+    {"name": "banking:edit", "category": "Banking", "description": "Edit bank accounts"},
+    {"name": "banking:delete", "category": "Banking", "description": "Delete bank accounts"},
+    {"name": "transfers:view", "category": "Banking", "description": "View fund transfers"},
+    {"name": "transfers:create", "category": "Banking", "description": "Create fund transfers"},
+    {"name": "reconciliation:view", "category": "Banking", "description": "View bank reconciliation"},
+    {"name": "reconciliation:create", "category": "Banking", "description": "Perform bank reconciliation"},
+    # Reports (template uses reports:view)
+    {"name": "reports:view", "category": "Reports", "description": "View reports"},
+    {"name": "reports:export", "category": "Reports", "description": "Export reports"},
+    # AI Analyst
+    {"name": "jarvis:ask", "category": "AI Analyst", "description": "Use AI assistant"},
+    # Customers
+    {"name": "customers:view", "category": "Customers", "description": "View customers"},
+    {"name": "customers:create", "category": "Customers", "description": "Create customers"},
+    {"name": "customers:edit", "category": "Customers", "description": "Edit customers"},
+    {"name": "customers:delete", "category": "Customers", "description": "Delete customers"},
+    # Vendors
+    {"name": "vendors:view", "category": "Vendors", "description": "View vendors"},
+    {"name": "vendors:create", "category": "Vendors", "description": "Create vendors"},
+    {"name": "vendors:edit", "category": "Vendors", "description": "Edit vendors"},
+    {"name": "vendors:delete", "category": "Vendors", "description": "Delete vendors"},
+    # Inventory (template uses products:view, categories:view, stock:view)
+    {"name": "products:view", "category": "Inventory", "description": "View products"},
+    {"name": "products:create", "category": "Inventory", "description": "Create products"},
+    {"name": "products:edit", "category": "Inventory", "description": "Edit products"},
+    {"name": "products:delete", "category": "Inventory", "description": "Delete products"},
+    {"name": "categories:view", "category": "Inventory", "description": "View categories"},
+    {"name": "categories:create", "category": "Inventory", "description": "Create categories"},
+    {"name": "categories:edit", "category": "Inventory", "description": "Edit categories"},
+    {"name": "categories:delete", "category": "Inventory", "description": "Delete categories"},
+    {"name": "stock:view", "category": "Inventory", "description": "View stock adjustments"},
+    {"name": "stock:create", "category": "Inventory", "description": "Create stock adjustments"},
+    # Purchases (template uses bills:view, bills:create, debit_notes:view)
+    {"name": "bills:view", "category": "Purchases", "description": "View purchase bills"},
+    {"name": "bills:create", "category": "Purchases", "description": "Create purchase bills"},
+    {"name": "bills:edit", "category": "Purchases", "description": "Edit purchase bills"},
+    {"name": "bills:delete", "category": "Purchases", "description": "Delete purchase bills"},
+    {"name": "debit_notes:view", "category": "Purchases", "description": "View debit notes"},
+    {"name": "debit_notes:create", "category": "Purchases", "description": "Create debit notes"},
+    {"name": "debit_notes:edit", "category": "Purchases", "description": "Edit and apply debit notes"},
+    # Sales (template uses invoices:view, invoices:create, credit_notes:view)
+    {"name": "invoices:view", "category": "Sales", "description": "View sales invoices"},
+    {"name": "invoices:create", "category": "Sales", "description": "Create sales invoices"},
+    {"name": "invoices:edit", "category": "Sales", "description": "Edit sales invoices"},
+    {"name": "invoices:delete", "category": "Sales", "description": "Delete sales invoices"},
+    {"name": "credit_notes:view", "category": "Sales", "description": "View credit notes"},
+    {"name": "credit_notes:create", "category": "Sales", "description": "Create credit notes"},
+    {"name": "credit_notes:edit", "category": "Sales", "description": "Edit and apply credit notes"},
+    # Expenses
+    {"name": "expenses:view", "category": "Expenses", "description": "View expenses"},
+    {"name": "expenses:create", "category": "Expenses", "description": "Create expenses"},
+    {"name": "expenses:edit", "category": "Expenses", "description": "Edit expenses"},
+    {"name": "expenses:delete", "category": "Expenses", "description": "Delete expenses"},
+    # Accounting (template uses accounts:view, journal:view)
+    {"name": "accounts:view", "category": "Accounting", "description": "View chart of accounts"},
+    {"name": "accounts:create", "category": "Accounting", "description": "Create accounts"},
+    {"name": "accounts:edit", "category": "Accounting", "description": "Edit accounts"},
+    {"name": "accounts:delete", "category": "Accounting", "description": "Delete accounts"},
+    {"name": "journal:view", "category": "Accounting", "description": "View journal entries"},
+    {"name": "journal:create", "category": "Accounting", "description": "Create journal entries"},
+    {"name": "journal:edit", "category": "Accounting", "description": "Edit journal entries"},
+    {"name": "journal:delete", "category": "Accounting", "description": "Delete journal entries"},
+    # HR (template uses employees:view, payroll:view)
+    {"name": "employees:view", "category": "HR", "description": "View employees"},
+    {"name": "employees:create", "category": "HR", "description": "Create employees"},
+    {"name": "employees:edit", "category": "HR", "description": "Edit employees"},
+    {"name": "employees:delete", "category": "HR", "description": "Delete employees"},
+    {"name": "payroll:view", "category": "HR", "description": "View payroll"},
+    {"name": "payroll:create", "category": "HR", "description": "Run payroll"},
+    # Budgeting
+    {"name": "budgets:view", "category": "Budgeting", "description": "View budgets"},
+    {"name": "budgets:create", "category": "Budgeting", "description": "Create budgets"},
+    {"name": "budgets:edit", "category": "Budgeting", "description": "Edit budgets"},
+    {"name": "budgets:delete", "category": "Budgeting", "description": "Delete budgets"},
+    # Other Income
+    {"name": "other_income:view", "category": "Other Income", "description": "View other income"},
+    {"name": "other_income:create", "category": "Other Income", "description": "Create other income"},
+    {"name": "other_income:edit", "category": "Other Income", "description": "Edit other income"},
+    {"name": "other_income:delete", "category": "Other Income", "description": "Delete other income"},
+    # Fixed Assets
+    {"name": "fixed_assets:view", "category": "Fixed Assets", "description": "View fixed assets"},
+    {"name": "fixed_assets:create", "category": "Fixed Assets", "description": "Create fixed assets"},
+    {"name": "fixed_assets:edit", "category": "Fixed Assets", "description": "Edit fixed assets"},
+    {"name": "fixed_assets:delete", "category": "Fixed Assets", "description": "Delete fixed assets"},
+    {"name": "fixed_assets:depreciate", "category": "Fixed Assets", "description": "Record depreciation"},
+    # Fiscal Year
+    {"name": "fiscal_year:view", "category": "Accounting", "description": "View fiscal years"},
+    {"name": "fiscal_year:create", "category": "Accounting", "description": "Create fiscal years"},
+    {"name": "fiscal_year:edit", "category": "Accounting", "description": "Edit fiscal years"},
+    {"name": "fiscal_year:close", "category": "Accounting", "description": "Close fiscal years"},
+    # Bank
+    {"name": "bank:create", "category": "Banking", "description": "Create bank accounts"},
+    {"name": "bank:edit", "category": "Banking", "description": "Edit bank accounts"},
+    {"name": "bank:delete", "category": "Banking", "description": "Delete bank accounts"},
+    {"name": "bank:reconcile", "category": "Banking", "description": "Perform bank reconciliation"},
+    # Inventory
+    {"name": "inventory:create", "category": "Inventory", "description": "Create inventory items"},
+    {"name": "inventory:edit", "category": "Inventory", "description": "Edit inventory items"},
+    {"name": "inventory:delete", "category": "Inventory", "description": "Delete inventory items"},
+    {"name": "inventory:adjust_stock", "category": "Inventory", "description": "Adjust stock levels"},
+    # Sales
+    {"name": "sales:create", "category": "Sales", "description": "Create sales invoices"},
+    {"name": "sales:edit", "category": "Sales", "description": "Edit sales invoices"},
+    {"name": "sales:delete", "category": "Sales", "description": "Delete sales invoices"},
+    # Purchases
+    {"name": "purchases:create", "category": "Purchases", "description": "Create purchase bills"},
+    {"name": "purchases:edit", "category": "Purchases", "description": "Edit purchase bills"},
+    {"name": "purchases:delete", "category": "Purchases", "description": "Delete purchase bills"},
+    # Credit Notes
+    {"name": "credit_notes:create", "category": "Sales", "description": "Create credit notes"},
+    {"name": "credit_notes:edit", "category": "Sales", "description": "Edit credit notes"},
+    # Debit Notes
+    {"name": "debit_notes:create", "category": "Purchases", "description": "Create debit notes"},
+    {"name": "debit_notes:edit", "category": "Purchases", "description": "Edit debit notes"},
+    # AI Assistant
+    {"name": "ai:use", "category": "AI Assistant", "description": "Use AI assistant for chat and analysis"},
+    {"name": "ai:configure", "category": "AI Assistant", "description": "Configure AI settings and providers"},
+    {"name": "ai:view_usage", "category": "AI Assistant", "description": "View AI usage statistics"},
+    # Agents
+    {"name": "agents:use", "category": "Agents", "description": "Use automation and audit agents"},
+    {"name": "agents:configure", "category": "Agents", "description": "Configure agent settings and schedules"},
+    {"name": "agents:view_findings", "category": "Agents", "description": "View agent findings and reports"},
+    {"name": "doc_wizard:use", "category": "Agents", "description": "Use the Doc Wizard for issue resolution"},
+]
+
 
-    # Remove duplicates from the list itself before processing
-    seen_names = set()
-    unique_permissions = []
-    for perm_data in all_permissions:
-        if perm_data["name"] not in seen_names:
-            seen_names.add(perm_data["name"])
-            unique_permissions.append(perm_data)
 
-    existing = {p.name for p in db.query(Permission.name).all()}
+def _unique_by_name(permissions: List[dict]) -> List[dict]:
+    """Keep the first definition of each permission name, in seed order"""
+    unique = {}
+    for perm_data in permissions:
+        unique.setdefault(perm_data["name"], perm_data)
+    return list(unique.values())
 
-    for perm_data in unique_permissions:
-        if perm_data["name"] not in existing:
-            perm = Permission(**perm_data)
-            db.add(perm)
+
+# Deduplicated once at import rather than on every seed_permissions call
+_UNIQUE_PERMISSIONS = _unique_by_name(_PERMISSIONS_SEED)
+
+
+def seed_permissions(db: Session):
+    """Seed default permissions into the database"""
+    # Insert everything in one statement and let the unique name constraint skip what exists
+    dialect = db.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert_stmt = sqlite_insert(Permission) if dialect == 'sqlite' else pg_insert(Permission)
+        db.execute(insert_stmt.values(_UNIQUE_PERMISSIONS).on_conflict_do_nothing(index_elements=['name']))
+    else:
+        existing = {name for (name,) in db.query(Permission.name).all()}
+        missing = [perm_data for perm_data in _UNIQUE_PERMISSIONS if perm_data["name"] not in existing]
+        if missing:
+            db.execute(insert(Permission), missing)
 
     db.commit()
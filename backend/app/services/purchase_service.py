@@ -1,21 +1,139 @@
 """
 Purchases Service - Bills, Debit Notes
+
+Bill/debit note items and ledger rows are written with Core executemany
+insert(); their batch size is the engine's insertmanyvalues_page_size
+(see app.core.database).
 """
-from typing import Optional, List
-from sqlalchemy.orm import Session, joinedload
+import re
+from typing import Optional, List, Dict
+from sqlalchemy import func, insert, update, case, exists
+from sqlalchemy.orm import Session, joinedload, selectinload
 from decimal import Decimal
 from datetime import date
-from app.models import PurchaseBill, PurchaseBillItem, DebitNote, DebitNoteItem, LedgerEntry, Account, Product, Vendor
+from app.models import (
+    PurchaseBill, PurchaseBillItem, DebitNote, DebitNoteItem, LedgerEntry, Account, Product, Vendor,
+    BankAccount, CashBookEntry
+)
 from app.schemas import PurchaseBillCreate
+from app.services.inventory_service import invalidate_product_cache
+from app.utils.numbering import last_number_query, number_after, next_number
+
+
+_BANK_WORD = re.compile(r'\bbank\b', re.IGNORECASE)
+
+
+def _cashbook_account_type(account: Account, has_bank_account: bool) -> str:
+    """Cash book account type: "bank" when linked to a bank account, otherwise by name.
+    
+    The name fallback matches "bank" as a whole word, so "Main Bank" is a bank
+    account but "Bankruptcy Clearing" is not.
+    """
+    if has_bank_account or (account.name and _BANK_WORD.search(account.name)):
+        return "bank"
+    return "cash"
+
+
+def _move_stock(db: Session, deltas: Dict[int, Decimal], allow_negative: bool = True) -> set:
+    """Add {product_id: quantity delta} to stock with a single UPDATE ... CASE.
+    
+    Returns the ids that were not updated: unknown products, or with
+    allow_negative=False those whose stock would drop below zero.
+    """
+    new_quantity = Product.stock_quantity + case(deltas, value=Product.id)
+    stmt = update(Product).where(Product.id.in_(deltas))
+    if not allow_negative:
+        stmt = stmt.where(new_quantity >= 0)
+    rows = db.execute(
+        stmt.values(stock_quantity=new_quantity).returning(Product.id, Product.branch_id)
+    ).all()
+    
+    for branch_id in {r.branch_id for r in rows}:
+        invalidate_product_cache(db, branch_id)
+    return set(deltas) - {r.id for r in rows}
 
 
-class PurchaseService:
+class _AccountLookupMixin:
+    """Chart-of-accounts lookups memoized for the life of the service (one request)"""
+    
+    def _get_account(self, business_id: int, name: str, code: str = None) -> Optional[Account]:
+        """Account by name, falling back to its code; misses are remembered too"""
+        key = (business_id, name)
+        if key not in self._account_cache:
+            account = self.db.query(Account).filter(
+                Account.business_id == business_id,
+                Account.name == name
+            ).first()
+            if not account and code:
+                account = self.db.query(Account).filter(
+                    Account.business_id == business_id,
+                    Account.code == code
+                ).first()
+            self._account_cache[key] = account
+        return self._account_cache[key]
+    
+    def _get_payable_account_id(self, business_id: int) -> Optional[int]:
+        """Id of the business's Accounts Payable account"""
+        account = self._get_account(business_id, "Accounts Payable")
+        return account.id if account else None
+    
+    def _get_vendor_advances_account(self, business_id: int) -> Optional[Account]:
+        """The Vendor Advances asset account (prepayments held by vendors)
+        
+        The account is created as "Vendor Advances", so that exact name is looked up
+        first on the (business_id, name) index; the substring scan is only a fallback
+        for charts where it was renamed by hand.
+        """
+        key = (business_id, "Vendor Advances")
+        if key not in self._account_cache:
+            self._account_cache[key] = self.db.query(Account).filter(
+                Account.business_id == business_id,
+                Account.name == "Vendor Advances"
+            ).first() or self.db.query(Account).filter(
+                Account.business_id == business_id,
+                Account.name.ilike('%Vendor Advance%')
+            ).first()
+        return self._account_cache[key]
+    
+    def _get_account_balance(self, account_id: int, branch_id: int) -> Decimal:
+        """Get current balance of a cash/bank account from ledger entries
+        
+        The sum is answered from ix_ledger_entries_account_branch_amounts alone,
+        without visiting the ledger rows themselves.
+        """
+        return self._account_balance_query(account_id, branch_id).scalar() or Decimal("0")
+    
+    def _account_balance_query(self, account_id: int, branch_id: int):
+        """Query for an account's ledger balance in a branch (usable as a scalar subquery)"""
+        return self.db.query(
+            func.sum(LedgerEntry.debit - LedgerEntry.credit)
+        ).filter(
+            LedgerEntry.account_id == account_id,
+            LedgerEntry.branch_id == branch_id
+        )
+
+
+class PurchaseService(_AccountLookupMixin):
     def __init__(self, db: Session):
         self.db = db
+        self._account_cache = {}
     
     def get_by_id(self, bill_id: int, business_id: int, branch_id: int = None) -> Optional[PurchaseBill]:
         query = self.db.query(PurchaseBill).options(
-            joinedload(PurchaseBill.items).joinedload(PurchaseBillItem.product),
+            # Items in their own IN query rather than repeating the bill columns per item row
+            selectinload(PurchaseBill.items).joinedload(PurchaseBillItem.product),
+            joinedload(PurchaseBill.vendor)
+        ).filter(
+            PurchaseBill.id == bill_id,
+            PurchaseBill.business_id == business_id
+        )
+        if branch_id:
+            query = query.filter(PurchaseBill.branch_id == branch_id)
+        return query.first()
+    
+    def get_by_id_summary(self, bill_id: int, business_id: int, branch_id: int = None) -> Optional[PurchaseBill]:
+        """Get a bill with its vendor but without items, for totals/status work"""
+        query = self.db.query(PurchaseBill).options(
             joinedload(PurchaseBill.vendor)
         ).filter(
             PurchaseBill.id == bill_id,
@@ -37,25 +155,13 @@ class PurchaseService:
         return query.order_by(PurchaseBill.created_at.desc()).all()
     
     def get_next_number(self, business_id: int) -> str:
-        last_bill = self.db.query(PurchaseBill).filter(
-            PurchaseBill.business_id == business_id
-        ).order_by(PurchaseBill.id.desc()).first()
-        
-        if last_bill:
-            try:
-                num = int(last_bill.bill_number.replace("PO-", ""))
-                return f"PO-{num + 1:05d}"
-            except ValueError:
-                pass
-        
-        return "PO-00001"
+        return next_number(self.db, PurchaseBill.bill_number, PurchaseBill.business_id, business_id, "PO")
     
     def create(self, bill_data: PurchaseBillCreate, business_id: int, branch_id: int, vat_rate: Decimal = Decimal("0")) -> PurchaseBill:
-        from app.models import Vendor, CashBookEntry
         from datetime import date as today_date
         
         # Calculate totals
-        sub_total = sum(item.quantity * item.price for item in bill_data.items)
+        sub_total = sum((item.quantity * item.price for item in bill_data.items), Decimal("0"))
         vat_amount = sub_total * (vat_rate / 100) if vat_rate else Decimal("0")
         total_amount = sub_total + vat_amount
         
@@ -75,41 +181,48 @@ class PurchaseService:
             business_id=business_id
         )
         self.db.add(bill)
-        self.db.flush()
+        self.db.flush()  # the only flush: items and ledger rows below are Core inserts keyed on bill.id
         
         # Create items
+        self.db.execute(insert(PurchaseBillItem), [
+            {
+                "purchase_bill_id": bill.id,
+                "product_id": item_data.product_id,
+                "quantity": item_data.quantity,
+                "price": item_data.price,
+                "returned_quantity": Decimal("0")
+            }
+            for item_data in bill_data.items
+        ])
+        
+        # Update product stock
+        deltas: Dict[int, Decimal] = {}
         for item_data in bill_data.items:
-            item = PurchaseBillItem(
-                purchase_bill_id=bill.id,
-                product_id=item_data.product_id,
-                quantity=item_data.quantity,
-                price=item_data.price,
-                returned_quantity=Decimal("0")
-            )
-            self.db.add(item)
-            
-            # Update product stock
-            product = self.db.query(Product).get(item_data.product_id)
-            if product:
-                product.stock_quantity += item_data.quantity
+            deltas[item_data.product_id] = deltas.get(item_data.product_id, Decimal("0")) + item_data.quantity
+        _move_stock(self.db, deltas)
         
         # Create ledger entries
-        self._create_ledger_entries(bill)
+        ledger_rows = self._bill_ledger_rows(bill)
         
         # Auto-deduct from vendor account balance if we have pre-paid funds with them
-        vendor = self.db.query(Vendor).filter(Vendor.id == bill_data.vendor_id).first()
+        # Locked so two bills for the same vendor cannot both spend the same advance
+        vendor = self.db.query(Vendor).filter(Vendor.id == bill_data.vendor_id).with_for_update().first()
         if vendor and vendor.account_balance and vendor.account_balance > 0:
-            self._apply_vendor_balance(bill, vendor)
+            ledger_rows += self._apply_vendor_balance(bill, vendor)
         
-        self.db.flush()
+        if ledger_rows:
+            self.db.execute(insert(LedgerEntry), ledger_rows)
+        
+        # Stock, vendor balance and bill status changes are flushed by the caller's commit
         return bill
     
-    def _apply_vendor_balance(self, bill: PurchaseBill, vendor: Vendor):
+    def _apply_vendor_balance(self, bill: PurchaseBill, vendor: Vendor) -> List[dict]:
         """Apply vendor's pre-paid balance to the bill
         
         Note: This is an internal accounting adjustment - NOT a cash transaction.
         Money was already paid when we funded the vendor's account.
-        We only create ledger entries, not CashBookEntry.
+        We only create ledger entries, not CashBookEntry; their rows are
+        returned for the caller to insert with the bill's other entries.
         """
         from datetime import date as today_date
         
@@ -117,7 +230,7 @@ class PurchaseService:
         amount_to_apply = min(vendor.account_balance, bill.total_amount - bill.paid_amount)
         
         if amount_to_apply <= 0:
-            return
+            return []
         
         # Update vendor balance
         vendor.account_balance -= amount_to_apply
@@ -130,129 +243,70 @@ class PurchaseService:
             bill.status = "Partial"
         
         # Get the Vendor Advances account (asset account)
-        vendor_advances_account = self.db.query(Account).filter(
-            Account.business_id == bill.business_id,
-            Account.name.ilike('%Vendor Advance%')
-        ).first()
+        vendor_advances_account = self._get_vendor_advances_account(bill.business_id)
         
         # Get Accounts Payable account
-        payable_account = self.db.query(Account).filter(
-            Account.business_id == bill.business_id,
-            Account.name == "Accounts Payable"
-        ).first()
-        
-        if vendor_advances_account and payable_account:
-            # Debit Accounts Payable (reduce liability - we owe less)
-            debit_entry = LedgerEntry(
-                transaction_date=today_date.today(),
-                description=f"Applied vendor advance to Bill {bill.bill_number}",
-                debit=amount_to_apply,
-                credit=Decimal("0"),
-                account_id=payable_account.id,
-                vendor_id=vendor.id,
-                purchase_bill_id=bill.id,
-                branch_id=bill.branch_id
-            )
-            self.db.add(debit_entry)
-            
-            # Credit Vendor Advances (reduce asset - we used our prepayment)
-            credit_entry = LedgerEntry(
-                transaction_date=today_date.today(),
-                description=f"Applied vendor advance to Bill {bill.bill_number}",
-                debit=Decimal("0"),
-                credit=amount_to_apply,
-                account_id=vendor_advances_account.id,
-                vendor_id=vendor.id,
-                purchase_bill_id=bill.id,
-                branch_id=bill.branch_id
-            )
-            self.db.add(credit_entry)
+        payable_account_id = self._get_payable_account_id(bill.business_id)
         
         # Note: No CashBookEntry is created here because this is NOT a cash transaction.
         # The money was already recorded in CashBook when we funded the vendor's account.
         # This is just an internal adjustment between asset (Vendor Advances) and liability (AP).
+        if not (vendor_advances_account and payable_account_id):
+            return []
+        
+        entry = {
+            "transaction_date": today_date.today(),
+            "description": f"Applied vendor advance to Bill {bill.bill_number}",
+            "vendor_id": vendor.id,
+            "purchase_bill_id": bill.id,
+            "branch_id": bill.branch_id
+        }
+        return [
+            # Debit Accounts Payable (reduce liability - we owe less)
+            {**entry, "debit": amount_to_apply, "credit": Decimal("0"), "account_id": payable_account_id},
+            # Credit Vendor Advances (reduce asset - we used our prepayment)
+            {**entry, "debit": Decimal("0"), "credit": amount_to_apply, "account_id": vendor_advances_account.id},
+        ]
     
-    def _create_ledger_entries(self, bill: PurchaseBill):
-        """Create double-entry ledger entries for purchase bill"""
+    def _bill_ledger_rows(self, bill: PurchaseBill) -> List[dict]:
+        """Build the double-entry ledger rows for a purchase bill"""
         # Get accounts
-        payable_account = self.db.query(Account).filter(
-            Account.business_id == bill.business_id,
-            Account.name == "Accounts Payable"
-        ).first()
-        
-        inventory_account = self.db.query(Account).filter(
-            Account.business_id == bill.business_id,
-            Account.name == "Inventory"
-        ).first()
-        
-        if not payable_account or not inventory_account:
-            return
-        
-        # Debit Inventory
-        debit_entry = LedgerEntry(
-            transaction_date=bill.bill_date,
-            description=f"Purchase Bill {bill.bill_number}",
-            debit=bill.sub_total,
-            credit=Decimal("0"),
-            account_id=inventory_account.id,
-            vendor_id=bill.vendor_id,
-            purchase_bill_id=bill.id,
-            branch_id=bill.branch_id
-        )
-        self.db.add(debit_entry)
-        
-        # Credit Accounts Payable
-        credit_entry = LedgerEntry(
-            transaction_date=bill.bill_date,
-            description=f"Purchase Bill {bill.bill_number}",
-            debit=Decimal("0"),
-            credit=bill.total_amount,
-            account_id=payable_account.id,
-            vendor_id=bill.vendor_id,
-            purchase_bill_id=bill.id,
-            branch_id=bill.branch_id
-        )
-        self.db.add(credit_entry)
+        payable_account_id = self._get_payable_account_id(bill.business_id)
+        inventory_account = self._get_account(bill.business_id, "Inventory")
+        
+        if not payable_account_id or not inventory_account:
+            return []
+        
+        entry = {
+            "transaction_date": bill.bill_date,
+            "description": f"Purchase Bill {bill.bill_number}",
+            "vendor_id": bill.vendor_id,
+            "purchase_bill_id": bill.id,
+            "branch_id": bill.branch_id
+        }
+        rows = [
+            # Debit Inventory
+            {**entry, "debit": bill.sub_total, "credit": Decimal("0"), "account_id": inventory_account.id},
+            # Credit Accounts Payable
+            {**entry, "debit": Decimal("0"), "credit": bill.total_amount, "account_id": payable_account_id},
+        ]
         
         # Debit VAT Receivable if applicable
         if bill.vat_amount > 0:
-            vat_account = self.db.query(Account).filter(
-                Account.business_id == bill.business_id,
-                Account.name == "VAT Payable"
-            ).first()
-            
+            vat_account = self._get_account(bill.business_id, "VAT Payable")
             if vat_account:
-                vat_entry = LedgerEntry(
-                    transaction_date=bill.bill_date,
-                    description=f"VAT for Purchase Bill {bill.bill_number}",
-                    debit=bill.vat_amount,
-                    credit=Decimal("0"),
-                    account_id=vat_account.id,
-                    vendor_id=bill.vendor_id,
-                    purchase_bill_id=bill.id,
-                    branch_id=bill.branch_id
-                )
-                self.db.add(vat_entry)
-    
-    def _get_account_balance(self, account_id: int, branch_id: int) -> Decimal:
-        """Get current balance of a cash/bank account from ledger entries"""
-        from sqlalchemy import func
-        from app.models import LedgerEntry as LE
-        
-        balance = self.db.query(
-            func.sum(LE.debit - LE.credit)
-        ).filter(
-            LE.account_id == account_id,
-            LE.branch_id == branch_id
-        ).scalar() or Decimal("0")
-        
-        return balance
+                rows.append({
+                    **entry,
+                    "description": f"VAT for Purchase Bill {bill.bill_number}",
+                    "debit": bill.vat_amount,
+                    "credit": Decimal("0"),
+                    "account_id": vat_account.id
+                })
+        
+        return rows
     
     def record_payment(self, bill_id: int, payment_data: dict, business_id: int) -> PurchaseBill:
-        from sqlalchemy import func
-        from app.models import LedgerEntry as LE
-        
-        bill = self.get_by_id(bill_id, business_id)
+        bill = self.get_by_id_summary(bill_id, business_id)
         if not bill:
             raise ValueError("Bill not found")
 
@@ -261,22 +315,19 @@ class PurchaseService:
         payment_date = payment_data["payment_date"]
         bank_account_id = payment_data.get("bank_account_id")  # May be None for cash accounts
 
-        # Get accounts
-        cash_account = self.db.query(Account).filter(
+        # Get the payment account, with whether it is linked to a bank account
+        has_bank_account = exists().where(BankAccount.chart_of_account_id == Account.id)
+        cash_account, cash_is_bank = self.db.query(Account, has_bank_account).filter(
             Account.id == payment_account_id,
             Account.business_id == business_id
-        ).first()
-
-        payable_account = self.db.query(Account).filter(
-            Account.business_id == business_id,
-            Account.name == "Accounts Payable"
-        ).first()
+        ).first() or (None, False)
+        payable_account_id = self._get_payable_account_id(business_id)
 
         # Validate accounts exist
         if not cash_account:
             raise ValueError(f"Payment account not found. Please select a valid cash/bank account.")
 
-        if not payable_account:
+        if not payable_account_id:
             raise ValueError(f"Accounts Payable account not found. Please check your Chart of Accounts setup.")
         
         # Check if account has sufficient balance before processing payment
@@ -308,81 +359,49 @@ class PurchaseService:
         elif bill.paid_amount > 0:
             bill.status = "Partial"
 
-        # Debit Accounts Payable (decrease liability)
-        debit_entry = LedgerEntry(
-            transaction_date=payment_date,
-            description=f"Payment for Bill {bill.bill_number}",
-            debit=amount,
-            credit=Decimal("0"),
-            account_id=payable_account.id,
-            vendor_id=bill.vendor_id,
-            purchase_bill_id=bill.id,
-            branch_id=bill.branch_id
-        )
-        self.db.add(debit_entry)
-
-        # Credit Cash/Bank (decrease asset)
-        # Include bank_account_id if this is a bank payment
-        credit_entry = LedgerEntry(
-            transaction_date=payment_date,
-            description=f"Payment for Bill {bill.bill_number}",
-            debit=Decimal("0"),
-            credit=amount,
-            account_id=cash_account.id,
-            bank_account_id=int(bank_account_id) if bank_account_id else None,
-            vendor_id=bill.vendor_id,
-            purchase_bill_id=bill.id,
-            branch_id=bill.branch_id
-        )
-        self.db.add(credit_entry)
+        # Create Cash Book Entry (its balance is read before this payment is posted)
+        vendor_name = bill.vendor.name if bill.vendor else None
+        self._create_cashbook_entry(bill, amount, cash_account, payment_date, current_balance, vendor_name,
+                                    cash_is_bank)
 
-        # Create Cash Book Entry
-        self._create_cashbook_entry(bill, amount, payment_account_id, cash_account, payment_date, bank_account_id)
+        entry = {
+            "transaction_date": payment_date,
+            "description": f"Payment for Bill {bill.bill_number}",
+            "vendor_id": bill.vendor_id,
+            "purchase_bill_id": bill.id,
+            "branch_id": bill.branch_id
+        }
+        self.db.execute(insert(LedgerEntry), [
+            # Debit Accounts Payable (decrease liability)
+            {**entry, "debit": amount, "credit": Decimal("0"), "account_id": payable_account_id,
+             "bank_account_id": None},
+            # Credit Cash/Bank (decrease asset)
+            # Include bank_account_id if this is a bank payment
+            {**entry, "debit": Decimal("0"), "credit": amount, "account_id": cash_account.id,
+             "bank_account_id": int(bank_account_id) if bank_account_id else None},
+        ])
 
         self.db.flush()
         return bill
     
-    def _create_cashbook_entry(self, bill: PurchaseBill, amount: Decimal,
-                                payment_account_id: int, cash_account: Account, payment_date: date,
-                                bank_account_id: int = None):
-        """Create a cash book entry for bill payment"""
-        from app.models import CashBookEntry
-        from sqlalchemy import func
-        from app.models import LedgerEntry as LE
+    def _create_cashbook_entry(self, bill: PurchaseBill, amount: Decimal, cash_account: Account,
+                                payment_date: date, current_balance: Decimal, vendor_name: str = None,
+                                has_bank_account: bool = False):
+        """Create a cash book entry for bill payment
         
+        current_balance is the payment account's ledger balance before this payment;
+        vendor_name is passed in so the bill's vendor relationship is never loaded here.
+        """
         # Determine account type (cash or bank)
-        account_type = "cash"
-        if hasattr(cash_account, 'bank_accounts') and cash_account.bank_accounts:
-            account_type = "bank"
-        elif cash_account.name and 'bank' in cash_account.name.lower():
-            account_type = "bank"
-        
-        # Get current balance from ledger
-        current_balance = self.db.query(
-            func.sum(LE.debit - LE.credit)
-        ).filter(
-            LE.account_id == cash_account.id,
-            LE.branch_id == bill.branch_id
-        ).scalar() or Decimal("0")
+        account_type = _cashbook_account_type(cash_account, has_bank_account)
         
         # Generate entry number
-        prefix = "CP"  # Cash Payment
-        last_entry = self.db.query(CashBookEntry).filter(
-            CashBookEntry.business_id == bill.business_id,
-            CashBookEntry.entry_number.like(f'{prefix}-%')
-        ).order_by(CashBookEntry.id.desc()).first()
-        
-        if last_entry:
-            try:
-                num = int(last_entry.entry_number.replace(f'{prefix}-', ''))
-                entry_number = f'{prefix}-{num + 1:05d}'
-            except ValueError:
-                entry_number = f'{prefix}-00001'
-        else:
-            entry_number = f'{prefix}-00001'
+        entry_number = next_number(
+            self.db, CashBookEntry.entry_number, CashBookEntry.business_id, bill.business_id, "CP"
+        )
         
         # Create cash book entry
-        cashbook_entry = CashBookEntry(
+        self.db.execute(insert(CashBookEntry).values(
             entry_number=entry_number,
             entry_date=payment_date,
             entry_type="payment",
@@ -390,20 +409,20 @@ class PurchaseService:
             account_type=account_type,
             amount=amount,
             balance_after=current_balance - amount,
-            description=f"Payment to {bill.vendor.name if bill.vendor else 'Vendor'} - Bill {bill.bill_number}",
+            description=f"Payment to {vendor_name or 'Vendor'} - Bill {bill.bill_number}",
             reference=bill.bill_number,
-            payee_payer=bill.vendor.name if bill.vendor else None,
+            payee_payer=vendor_name,
             source_type="purchase_payment",
             source_id=bill.id,
             branch_id=bill.branch_id,
             business_id=bill.business_id
-        )
-        self.db.add(cashbook_entry)
+        ))
 
 
-class DebitNoteService:
+class DebitNoteService(_AccountLookupMixin):
     def __init__(self, db: Session):
         self.db = db
+        self._account_cache = {}
     
     def get_by_id(self, debit_note_id: int, business_id: int, branch_id: int = None) -> Optional[DebitNote]:
         query = self.db.query(DebitNote).options(
@@ -426,18 +445,7 @@ class DebitNoteService:
         ).order_by(DebitNote.created_at.desc()).all()
     
     def get_next_number(self, business_id: int) -> str:
-        last_dn = self.db.query(DebitNote).filter(
-            DebitNote.business_id == business_id
-        ).order_by(DebitNote.id.desc()).first()
-        
-        if last_dn:
-            try:
-                num = int(last_dn.debit_note_number.replace("DN-", ""))
-                return f"DN-{num + 1:05d}"
-            except ValueError:
-                pass
-        
-        return "DN-00001"
+        return next_number(self.db, DebitNote.debit_note_number, DebitNote.business_id, business_id, "DN")
     
     def create_for_bill(self, original_bill: PurchaseBill, items_to_return: List[dict], debit_note_date: date, reason: str = "Purchase Return") -> DebitNote:
         """
@@ -448,7 +456,7 @@ class DebitNoteService:
         2. Update returned_quantity on original purchase bill items
         3. Create the debit note record with vendor_id and status
         """
-        total_amount = sum(item["quantity"] * item["price"] for item in items_to_return)
+        total_amount = sum((item["quantity"] * item["price"] for item in items_to_return), Decimal("0"))
         
         debit_note = DebitNote(
             debit_note_number=self.get_next_number(original_bill.business_id),
@@ -464,28 +472,41 @@ class DebitNoteService:
         self.db.add(debit_note)
         self.db.flush()
         
+        # Create debit note items with original_item_id
+        self.db.execute(insert(DebitNoteItem), [
+            {
+                "debit_note_id": debit_note.id,
+                "product_id": item_data["product_id"],
+                "quantity": item_data["quantity"],
+                "price": item_data["price"],
+                "original_item_id": item_data.get("original_item_id")
+            }
+            for item_data in items_to_return
+        ])
+        
+        # Reduce product stock - when returning goods to vendor, inventory decreases
+        deltas: Dict[int, Decimal] = {}
         for item_data in items_to_return:
-            # Create debit note item with original_item_id
-            dn_item = DebitNoteItem(
-                debit_note_id=debit_note.id,
-                product_id=item_data["product_id"],
-                quantity=item_data["quantity"],
-                price=item_data["price"],
-                original_item_id=item_data.get("original_item_id")
-            )
-            self.db.add(dn_item)
-            
-            # Reduce product stock - when returning goods to vendor, inventory decreases
-            product = self.db.query(Product).get(item_data["product_id"])
+            deltas[item_data["product_id"]] = deltas.get(item_data["product_id"], Decimal("0")) - item_data["quantity"]
+        rejected = _move_stock(self.db, deltas, allow_negative=False)
+        if rejected:
+            # Unknown products are skipped; any that exist are short of stock
+            product = self.db.query(Product).filter(Product.id.in_(rejected)).order_by(Product.id).first()
             if product:
-                if product.stock_quantity < item_data["quantity"]:
-                    raise ValueError(f"Insufficient stock for product {product.name}. Available: {product.stock_quantity}, Trying to return: {item_data['quantity']}")
-                product.stock_quantity -= item_data["quantity"]
-            
-            # Update returned quantity on original purchase bill item
-            orig_item = self.db.query(PurchaseBillItem).get(item_data.get("original_item_id"))
-            if orig_item:
-                orig_item.returned_quantity += item_data["quantity"]
+                raise ValueError(f"Insufficient stock for product {product.name}. Available: {product.stock_quantity}, Trying to return: {-deltas[product.id]}")
+        
+        # Update returned quantity on original purchase bill items, in SQL so
+        # concurrent returns against the same line cannot overwrite each other
+        returned: Dict[int, Decimal] = {}
+        for item_data in items_to_return:
+            if item_data.get("original_item_id"):
+                returned[item_data["original_item_id"]] = returned.get(item_data["original_item_id"], Decimal("0")) + item_data["quantity"]
+        if returned:
+            self.db.execute(
+                update(PurchaseBillItem)
+                .where(PurchaseBillItem.id.in_(returned))
+                .values(returned_quantity=PurchaseBillItem.returned_quantity + case(returned, value=PurchaseBillItem.id))
+            )
         
         # Create ledger entries for the debit note
         self._create_debit_note_ledger_entries(debit_note, original_bill)
@@ -496,60 +517,30 @@ class DebitNoteService:
     def _create_debit_note_ledger_entries(self, debit_note: DebitNote, original_bill: PurchaseBill):
         """Create double-entry ledger entries for debit note (purchase return)"""
         # Get accounts - try by name first, then by code as fallback
-        payable_account = self.db.query(Account).filter(
-            Account.business_id == debit_note.business_id,
-            Account.name == "Accounts Payable"
-        ).first()
-        
-        if not payable_account:
-            # Fallback to code-based lookup
-            payable_account = self.db.query(Account).filter(
-                Account.business_id == debit_note.business_id,
-                Account.code == "2000"
-            ).first()
-        
-        inventory_account = self.db.query(Account).filter(
-            Account.business_id == debit_note.business_id,
-            Account.name == "Inventory"
-        ).first()
-        
-        if not inventory_account:
-            # Fallback to code-based lookup
-            inventory_account = self.db.query(Account).filter(
-                Account.business_id == debit_note.business_id,
-                Account.code == "1300"
-            ).first()
+        payable_account_id = self._get_payable_account_id(debit_note.business_id)
+        if not payable_account_id:
+            payable_account = self._get_account(debit_note.business_id, "Accounts Payable", code="2000")
+            payable_account_id = payable_account.id if payable_account else None
+        inventory_account = self._get_account(debit_note.business_id, "Inventory", code="1300")
         
-        if not payable_account or not inventory_account:
+        if not payable_account_id or not inventory_account:
             print(f"Warning: Could not find accounts for debit note ledger entries. "
-                  f"AP found: {payable_account is not None}, Inventory found: {inventory_account is not None}")
+                  f"AP found: {payable_account_id is not None}, Inventory found: {inventory_account is not None}")
             return
         
-        # Debit Accounts Payable (reduce liability - we owe vendor less)
-        debit_entry = LedgerEntry(
-            transaction_date=debit_note.debit_note_date,
-            description=f"Debit Note {debit_note.debit_note_number} - Return to Vendor",
-            debit=debit_note.total_amount,
-            credit=Decimal("0"),
-            account_id=payable_account.id,
-            vendor_id=debit_note.vendor_id,
-            debit_note_id=debit_note.id,
-            branch_id=debit_note.branch_id
-        )
-        self.db.add(debit_entry)
-        
-        # Credit Inventory (reduce asset - goods returned to vendor)
-        credit_entry = LedgerEntry(
-            transaction_date=debit_note.debit_note_date,
-            description=f"Debit Note {debit_note.debit_note_number} - Return to Vendor",
-            debit=Decimal("0"),
-            credit=debit_note.total_amount,
-            account_id=inventory_account.id,
-            vendor_id=debit_note.vendor_id,
-            debit_note_id=debit_note.id,
-            branch_id=debit_note.branch_id
-        )
-        self.db.add(credit_entry)
+        entry = {
+            "transaction_date": debit_note.debit_note_date,
+            "description": f"Debit Note {debit_note.debit_note_number} - Return to Vendor",
+            "vendor_id": debit_note.vendor_id,
+            "debit_note_id": debit_note.id,
+            "branch_id": debit_note.branch_id
+        }
+        self.db.execute(insert(LedgerEntry), [
+            # Debit Accounts Payable (reduce liability - we owe vendor less)
+            {**entry, "debit": debit_note.total_amount, "credit": Decimal("0"), "account_id": payable_account_id},
+            # Credit Inventory (reduce asset - goods returned to vendor)
+            {**entry, "debit": Decimal("0"), "credit": debit_note.total_amount, "account_id": inventory_account.id},
+        ])
         
         print(f"Created ledger entries for Debit Note {debit_note.debit_note_number}: "
               f"Debit AP {debit_note.total_amount}, Credit Inventory {debit_note.total_amount}")
@@ -571,7 +562,11 @@ class DebitNoteService:
             refund_account_id: Cash/bank account for cash refund
             refund_date: Date for refund transaction
         """
-        debit_note = self.db.query(DebitNote).filter(
+        # Load the debit note with its original bill and vendor in one query
+        debit_note = self.db.query(DebitNote).options(
+            joinedload(DebitNote.purchase_bill),
+            joinedload(DebitNote.vendor)
+        ).filter(
             DebitNote.id == debit_note_id,
             DebitNote.business_id == business_id
         ).first()
@@ -583,12 +578,12 @@ class DebitNoteService:
             raise ValueError(f"Debit note is already {debit_note.status}")
         
         # Get the original bill
-        bill = self.db.query(PurchaseBill).get(debit_note.purchase_bill_id)
+        bill = debit_note.purchase_bill
         if not bill:
             raise ValueError("Original bill not found")
         
         # Get vendor
-        vendor = self.db.query(Vendor).get(debit_note.vendor_id)
+        vendor = debit_note.vendor
         
         # Track previous returns to calculate refundable amount correctly
         previous_returned = bill.returned_amount or Decimal("0.00")
@@ -622,8 +617,8 @@ class DebitNoteService:
                     raise ValueError("Refund account is required for cash refunds")
                 if not refund_date:
                     refund_date = date.today()
-                self._refund_to_cash_account(debit_note, bill, vendor, refund_amount, 
-                                            refund_account_id, refund_date)
+                self._refund_to_cash_account(debit_note, bill, vendor.name if vendor else None,
+                                            refund_amount, refund_account_id, refund_date)
         
         # Update bill status based on effective balance
         if effective_balance <= 0:
@@ -653,46 +648,28 @@ class DebitNoteService:
         vendor.account_balance = (vendor.account_balance or Decimal("0.00")) + refund_amount
         
         # Get the Vendor Advances account (asset account)
-        vendor_advances_account = self.db.query(Account).filter(
-            Account.business_id == debit_note.business_id,
-            Account.name.ilike('%Vendor Advance%')
-        ).first()
+        vendor_advances_account = self._get_vendor_advances_account(debit_note.business_id)
         
         # Get Accounts Payable account
-        payable_account = self.db.query(Account).filter(
-            Account.business_id == debit_note.business_id,
-            Account.name == "Accounts Payable"
-        ).first()
-        
-        if vendor_advances_account and payable_account:
-            # Debit Vendor Advances (increase asset - we have more credit with vendor)
-            debit_entry = LedgerEntry(
-                transaction_date=today_date.today(),
-                description=f"Refund from Debit Note {debit_note.debit_note_number} - Added to vendor balance",
-                debit=refund_amount,
-                credit=Decimal("0"),
-                account_id=vendor_advances_account.id,
-                vendor_id=vendor.id,
-                debit_note_id=debit_note.id,
-                branch_id=debit_note.branch_id
-            )
-            self.db.add(debit_entry)
-            
-            # Credit Accounts Payable (reduce liability further since we're getting credit)
-            credit_entry = LedgerEntry(
-                transaction_date=today_date.today(),
-                description=f"Refund from Debit Note {debit_note.debit_note_number} - Added to vendor balance",
-                debit=Decimal("0"),
-                credit=refund_amount,
-                account_id=payable_account.id,
-                vendor_id=vendor.id,
-                debit_note_id=debit_note.id,
-                branch_id=debit_note.branch_id
-            )
-            self.db.add(credit_entry)
+        payable_account_id = self._get_payable_account_id(debit_note.business_id)
+        
+        if vendor_advances_account and payable_account_id:
+            entry = {
+                "transaction_date": today_date.today(),
+                "description": f"Refund from Debit Note {debit_note.debit_note_number} - Added to vendor balance",
+                "vendor_id": vendor.id,
+                "debit_note_id": debit_note.id,
+                "branch_id": debit_note.branch_id
+            }
+            self.db.execute(insert(LedgerEntry), [
+                # Debit Vendor Advances (increase asset - we have more credit with vendor)
+                {**entry, "debit": refund_amount, "credit": Decimal("0"), "account_id": vendor_advances_account.id},
+                # Credit Accounts Payable (reduce liability further since we're getting credit)
+                {**entry, "debit": Decimal("0"), "credit": refund_amount, "account_id": payable_account_id},
+            ])
     
     def _refund_to_cash_account(self, debit_note: DebitNote, bill: PurchaseBill,
-                                vendor: Vendor, refund_amount: Decimal,
+                                vendor_name: Optional[str], refund_amount: Decimal,
                                 refund_account_id: int, refund_date: date):
         """
         Receive a cash/bank refund from the vendor.
@@ -700,97 +677,46 @@ class DebitNoteService:
         This creates:
         1. Ledger entries (Debit Cash/Bank, Credit Accounts Payable)
         2. CashBook entry (receipt)
+        
+        The vendor is passed by name (its id is on the debit note), so no
+        relationship is loaded here.
         """
-        from app.models import CashBookEntry
-        from sqlalchemy import func
-        from app.models import LedgerEntry as LE
+        business_id, branch_id = debit_note.business_id, debit_note.branch_id
+        dn_number = debit_note.debit_note_number
         
-        # Get the refund account
-        refund_account = self.db.query(Account).filter(
+        # Get the refund account with any linked bank account; Accounts Payable comes from the cache
+        refund_account, bank_account_id = self.db.query(Account, BankAccount.id).outerjoin(
+            BankAccount, BankAccount.chart_of_account_id == Account.id
+        ).filter(
             Account.id == refund_account_id,
-            Account.business_id == debit_note.business_id
-        ).first()
+            Account.business_id == business_id
+        ).first() or (None, None)
+        payable_account_id = self._get_payable_account_id(business_id)
         
         if not refund_account:
             raise ValueError("Refund account not found")
         
-        # Get Accounts Payable account
-        payable_account = self.db.query(Account).filter(
-            Account.business_id == debit_note.business_id,
-            Account.name == "Accounts Payable"
-        ).first()
-        
-        if not payable_account:
+        if not payable_account_id:
             raise ValueError("Accounts Payable account not found")
         
-        # Debit Cash/Bank (increase asset - money coming in)
-        debit_entry = LedgerEntry(
-            transaction_date=refund_date,
-            description=f"Refund from Vendor for Debit Note {debit_note.debit_note_number}",
-            debit=refund_amount,
-            credit=Decimal("0"),
-            account_id=refund_account.id,
-            vendor_id=vendor.id if vendor else None,
-            debit_note_id=debit_note.id,
-            branch_id=debit_note.branch_id
-        )
-        self.db.add(debit_entry)
-        
-        # Credit Accounts Payable (reduce liability)
-        credit_entry = LedgerEntry(
-            transaction_date=refund_date,
-            description=f"Refund from Vendor for Debit Note {debit_note.debit_note_number}",
-            debit=Decimal("0"),
-            credit=refund_amount,
-            account_id=payable_account.id,
-            vendor_id=vendor.id if vendor else None,
-            debit_note_id=debit_note.id,
-            branch_id=debit_note.branch_id
-        )
-        self.db.add(credit_entry)
-        
         # Create CashBook Entry (receipt)
         # Determine account type
-        account_type = "cash"
-        if refund_account.name and 'bank' in refund_account.name.lower():
-            account_type = "bank"
-        
-        # Check if there's a bank account linked
-        bank_account_id = None
-        if account_type == "bank":
-            from app.models import BankAccount
-            bank_account = self.db.query(BankAccount).filter(
-                BankAccount.account_id == refund_account.id
-            ).first()
-            if bank_account:
-                bank_account_id = bank_account.id
+        account_type = _cashbook_account_type(refund_account, bank_account_id is not None)
         
-        # Get current balance
-        current_balance = self.db.query(
-            func.sum(LE.debit - LE.credit)
-        ).filter(
-            LE.account_id == refund_account.id,
-            LE.branch_id == debit_note.branch_id
-        ).scalar() or Decimal("0")
+        # Get current balance and the last receipt number in one round-trip
+        current_balance, last_number = self.db.query(
+            self._account_balance_query(refund_account.id, branch_id).scalar_subquery(),
+            last_number_query(
+                self.db, CashBookEntry.entry_number, CashBookEntry.business_id, business_id, "CR"
+            ).scalar_subquery()
+        ).one()
+        current_balance = current_balance or Decimal("0")
         
         # Generate entry number
-        prefix = "CR"  # Cash Receipt
-        last_entry = self.db.query(CashBookEntry).filter(
-            CashBookEntry.business_id == debit_note.business_id,
-            CashBookEntry.entry_number.like(f'{prefix}-%')
-        ).order_by(CashBookEntry.id.desc()).first()
-        
-        if last_entry:
-            try:
-                num = int(last_entry.entry_number.replace(f'{prefix}-', ''))
-                entry_number = f'{prefix}-{num + 1:05d}'
-            except ValueError:
-                entry_number = f'{prefix}-00001'
-        else:
-            entry_number = f'{prefix}-00001'
+        entry_number = number_after("CR", last_number)
         
         # Create cash book entry (receipt)
-        cashbook_entry = CashBookEntry(
+        self.db.execute(insert(CashBookEntry).values(
             entry_number=entry_number,
             entry_date=refund_date,
             entry_type="receipt",
@@ -798,15 +724,31 @@ class DebitNoteService:
             account_type=account_type,
             amount=refund_amount,
             balance_after=current_balance + refund_amount,
-            description=f"Refund from {vendor.name if vendor else 'Vendor'} - Debit Note {debit_note.debit_note_number}",
-            reference=debit_note.debit_note_number,
-            payee_payer=vendor.name if vendor else None,
+            description=f"Refund from {vendor_name or 'Vendor'} - Debit Note {dn_number}",
+            reference=dn_number,
+            payee_payer=vendor_name,
             source_type="debit_note_refund",
             source_id=debit_note.id,
-            branch_id=debit_note.branch_id,
-            business_id=debit_note.business_id
-        )
-        self.db.add(cashbook_entry)
+            branch_id=branch_id,
+            business_id=business_id
+        ))
+        
+        # Ledger entries are written after the cash book balance above was read
+        entry = {
+            "transaction_date": refund_date,
+            "description": f"Refund from Vendor for Debit Note {dn_number}",
+            "vendor_id": debit_note.vendor_id,
+            "debit_note_id": debit_note.id,
+            "branch_id": branch_id
+        }
+        self.db.execute(insert(LedgerEntry), [
+            # Debit Cash/Bank (increase asset - money coming in)
+            {**entry, "debit": refund_amount, "credit": Decimal("0"), "account_id": refund_account.id,
+             "bank_account_id": bank_account_id},
+            # Credit Accounts Payable (reduce liability)
+            {**entry, "debit": Decimal("0"), "credit": refund_amount, "account_id": payable_account_id,
+             "bank_account_id": None},
+        ])
         
         # Track refund amount on debit note
         debit_note.refund_amount = refund_amount
@@ -7,6 +7,7 @@ from decimal import Decimal
 from datetime import date
 from app.models import SalesInvoice, SalesInvoiceItem, CreditNote, CreditNoteItem, LedgerEntry, Account, Product, Customer, BadDebt
 from app.schemas import SalesInvoiceCreate, SalesInvoiceUpdate
+from app.services.inventory_service import invalidate_product_cache
 
 
 class SalesService:
@@ -169,6 +170,7 @@ class SalesService:
                     'quantity': item_data.quantity,
                     'purchase_price': product.purchase_price or Decimal("0")
                 }
+        invalidate_product_cache(self.db, branch_id)
         
         # Create ledger entries
         self._create_ledger_entries(invoice, product_costs)
@@ -708,6 +710,7 @@ class CreditNoteService:
             orig_item = self.db.query(SalesInvoiceItem).get(item_data.get("original_item_id"))
             if orig_item:
                 orig_item.returned_quantity += item_data["quantity"]
+        invalidate_product_cache(self.db, credit_note.branch_id)
         
         # Create ledger entries for credit note
         self._create_credit_note_ledger_entries(credit_note, original_invoice)
@@ -6,6 +6,7 @@ from sqlalchemy.orm import Session, joinedload
 from app.models import User, Business, Branch, Role, UserBranchRole, Permission, RolePermission
 from app.schemas import UserCreate, UserUpdate
 from app.core.security import get_password_hash, verify_password
+from app.services.permission_service import invalidate_permission_cache
 
 
 class UserService:
@@ -154,6 +155,7 @@ class UserService:
         )
         self.db.add(assignment)
         self.db.flush()
+        invalidate_permission_cache(self.db)
         return assignment
     
     def remove_role(self, user_id: int, branch_id: int, role_id: int) -> bool:
@@ -167,4 +169,5 @@ class UserService:
             return False
         
         self.db.delete(assignment)
+        invalidate_permission_cache(self.db)
         return True
@@ -0,0 +1,39 @@
+"""
+Document numbering - sequential "<prefix>-NNNNN" numbers per business
+"""
+from typing import Optional
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+
+def last_number_query(db: Session, number_column, business_column, business_id: int, prefix: str):
+    """Query for the highest "<prefix>-NNNNN" number of a business.
+
+    Only the number column of the single highest row is read: the range keeps the
+    lookup on the prefix (suffix starting with a digit) and ordering by length
+    then value sorts the zero-padded suffixes numerically without a CAST, which
+    would fail on PostgreSQL for hand-typed numbers such as "PO-12A".
+    """
+    return db.query(number_column).filter(
+        business_column == business_id,
+        number_column >= f"{prefix}-0",
+        number_column < f"{prefix}-:"  # ':' sorts right after '9'
+    ).order_by(func.length(number_column).desc(), number_column.desc()).limit(1)
+
+
+def number_after(prefix: str, last_number: Optional[str]) -> str:
+    """The "<prefix>-NNNNN" number following last_number"""
+    num = 0
+    if last_number:
+        try:
+            num = int(last_number[len(prefix) + 1:])
+        except ValueError:
+            pass
+    return f"{prefix}-{num + 1:05d}"
+
+
+def next_number(db: Session, number_column, business_column, business_id: int, prefix: str) -> str:
+    """Next "<prefix>-NNNNN" number for a business, one past the highest existing one"""
+    return number_after(
+        prefix, last_number_query(db, number_column, business_column, business_id, prefix).scalar()
+    )
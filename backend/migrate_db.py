@@ -825,7 +825,6 @@ def migrate_database(dry_run: bool = False):
     # ==================== CREATE INDEXES ====================
     print("\n[11] Creating indexes...")
     indexes = [
-        ('idx_ledger_entries_account_id', 'ledger_entries(account_id)'),
         ('idx_ledger_entries_transaction_date', 'ledger_entries(transaction_date)'),
         ('idx_ledger_entries_bank_account_id', 'ledger_entries(bank_account_id)'),
         ('idx_payments_account_id', 'payments(account_id)'),
@@ -836,6 +835,18 @@ def migrate_database(dry_run: bool = False):
         ('idx_budget_items_account_id', 'budget_items(account_id)'),
         ('idx_fixed_assets_business_id', 'fixed_assets(business_id)'),
         ('idx_fixed_assets_branch_id', 'fixed_assets(branch_id)'),
+        ('ix_products_low_stock', 'products(branch_id) WHERE is_active = 1 AND stock_quantity <= reorder_level'),
+        ('ix_purchase_bills_business_date', 'purchase_bills(business_id, bill_date)'),
+        ('ix_sales_invoices_business_date', 'sales_invoices(business_id, invoice_date)'),
+        ('ix_purchase_bill_items_product_bill', 'purchase_bill_items(product_id, purchase_bill_id)'),
+        ('ix_sales_invoice_items_product_invoice', 'sales_invoice_items(product_id, sales_invoice_id)'),
+        ('ix_other_incomes_branch_date', 'other_incomes(business_id, branch_id, income_date, id)'),
+        ('ix_other_incomes_business_category', 'other_incomes(business_id, category)'),
+        ('ix_cash_book_entries_business_number', 'cash_book_entries(business_id, entry_number)'),
+        ('ix_ledger_entries_account_branch_amounts', 'ledger_entries(account_id, branch_id, debit, credit)'),
+        ('ix_accounts_business_name', 'accounts(business_id, name)'),
+        ('ix_purchase_bills_branch_created', 'purchase_bills(business_id, branch_id, created_at)'),
+        ('ix_debit_notes_branch_created', 'debit_notes(business_id, branch_id, created_at)'),
     ]
     
     for index_name, index_def in indexes:
@@ -845,6 +856,42 @@ def migrate_database(dry_run: bool = False):
         except Exception as e:
             print(f"  Note: Index {index_name} may already exist: {e}")
     
+    # The composite indexes lead with the same column, so the single-column ones are redundant
+    for index_name, replaced_by in [('ix_purchase_bills_business_id', 'ix_purchase_bills_business_date'),
+                                    ('ix_sales_invoices_business_id', 'ix_sales_invoices_business_date'),
+                                    ('ix_ledger_entries_account_id', 'ix_ledger_entries_account_branch_amounts'),
+                                    ('idx_ledger_entries_account_id', 'ix_ledger_entries_account_branch_amounts'),
+                                    ('ix_accounts_business_id', 'ix_accounts_business_name')]:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name=?", (replaced_by,))
+        if cursor.fetchone():
+            cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+            print(f"  ✓ Dropped redundant index {index_name}")
+    
+    # ==================== CREATE UNIQUE INDEXES ====================
+    print("\n[11b] Creating unique indexes...")
+    # Empty SKUs mean "no SKU" and must not collide with each other
+    cursor.execute("UPDATE products SET sku = NULL WHERE sku = ''")
+    unique_indexes = [
+        ('uq_product_sku', 'products(sku, business_id)'),
+    ]
+    
+    for index_name, index_def in unique_indexes:
+        try:
+            cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {index_def}")
+            print(f"  ✓ Created unique index {index_name}")
+        except Exception as e:
+            print(f"  Note: Could not create unique index {index_name} (duplicate values?): {e}")
+    
+    # ix_products_sku is a prefix of uq_product_sku; drop it once the latter exists
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='uq_product_sku'")
+    if cursor.fetchone():
+        cursor.execute("DROP INDEX IF EXISTS ix_products_sku")
+        print("  ✓ Dropped redundant index ix_products_sku")
+    
+    # Refresh planner statistics so the composite/covering indexes above get picked
+    cursor.execute("ANALYZE")
+    print("  ✓ Updated query planner statistics")
+    
     # ==================== CREATE MISSING TABLES ====================
     print("\n[12] Checking for missing tables...")
     
@@ -22,6 +22,7 @@ def list_other_incomes():
     params = {}
     if category:
         params['category'] = category
+        params['exact_category'] = 'true'  # picked from the categories dropdown
     if start_date:
         params['start_date'] = start_date
     if end_date: